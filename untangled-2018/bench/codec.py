@@ -0,0 +1,85 @@
+"""Times encoding and decoding every networked component in a benchmark
+world, packed with lib.codec against as_dict and BSON (how we used to do it).
+
+Run from the untangled-2018 folder:
+    python -m bench.codec [--size 1000]
+"""
+import argparse
+import json
+import time
+
+import bson
+
+from bench.world import build_game
+from lib.codec import PackedWriter, read_packed
+
+
+def time_it(function, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(size, repeat=5):
+    game = build_game(size, systems=[])
+
+    # Every networked component there is, by its name
+    found = {}
+    for key, entity in game.entities.items():
+        for component in entity.values():
+            if component.is_networked():
+                found.setdefault(component.get_name(), []).append(component)
+
+    results = []
+    writer = PackedWriter()
+    totals = {'bson_encode_ms': 0.0, 'bson_decode_ms': 0.0, 'packed_encode_ms': 0.0, 'packed_decode_ms': 0.0}
+    for name, found_components in sorted(found.items()):
+        if not all(writer.add(0, component) for component in found_components):
+            # Sent as BSON anyway, so nothing to compare
+            results.append({'bench': 'codec', 'name': name, 'count': len(found_components), 'packed': False})
+            continue
+
+        def bson_encode():
+            return [bson.dumps(component.as_dict()) for component in found_components]
+
+        def packed_encode():
+            writer.clear()
+            for component in found_components:
+                writer.add(0, component)
+            return writer.getvalue()
+
+        encoded = bson_encode()
+        packed = packed_encode()
+        result = {
+            'bench': 'codec',
+            'name': name,
+            'count': len(found_components),
+            'packed': True,
+            'bson_encode_ms': time_it(bson_encode, repeat),
+            'bson_decode_ms': time_it(lambda: [bson.loads(data) for data in encoded], repeat),
+            'packed_encode_ms': time_it(packed_encode, repeat),
+            'packed_decode_ms': time_it(lambda: list(read_packed(packed)), repeat),
+            'bson_bytes': sum(len(data) for data in encoded),
+            'packed_bytes': len(packed),
+        }
+        for total in totals:
+            totals[total] += result[total]
+        results.append(result)
+
+    totals.update({
+        'bench': 'codec',
+        'name': 'total',
+        'encode_speedup': totals['bson_encode_ms'] / totals['packed_encode_ms'],
+        'decode_speedup': totals['bson_decode_ms'] / totals['packed_decode_ms'],
+    })
+    results.append(totals)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1000)
+    args = parser.parse_args()
+    for result in run(args.size):
+        print(json.dumps(result))
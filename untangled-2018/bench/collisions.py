@@ -0,0 +1,113 @@
+"""Times a frame of collision checks with lots of entities overlapping each
+other, looking up collision events by pair and by scanning every event (how
+we used to do it).
+
+Run from the untangled-2018 folder:
+    python -m bench.collisions
+"""
+import json
+import os
+import random
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from game.components import *
+from game.game import GameState
+from game.systems.collisionsystem import CollisionSystem, CollisionCall
+from lib.world import World
+
+# Collides without doing anything, so we only time the collision system
+NO_CALLS = CollisionCall()
+
+
+class LegacyCollisionSystem(CollisionSystem):
+    """Finds events by looking through every one of them."""
+
+    def collisionExists(self, keys: list):
+        for e in self.events.values():
+            c = 0
+            for x in keys:
+                if x in e.keys:
+                    c += 1
+            if c >= len(keys):
+                return e
+        return None
+
+    def createCollision(self, game, keys: list):
+        if self.collisionExists(keys) is None:
+            super().createCollision(game, keys)
+
+
+class BenchGame:
+    """Just enough of a GameState to collide entities."""
+    query = GameState.query
+
+    def __init__(self, collisionSystem):
+        self.entities = World()
+        self.collisionSystem = collisionSystem
+        self.entities.on_delete.append(collisionSystem.on_entity_deleted)
+
+    def get_collision_functions(self, entity):
+        return NO_CALLS
+
+
+def build_game(collisionSystem, size, area, rng):
+    game = BenchGame(collisionSystem)
+    for key in range(size):
+        game.entities[key] = {
+            IngameObject: IngameObject(position=(rng.uniform(0, area), rng.uniform(0, area)), size=(64, 64)),
+            Collidable: Collidable(call_name='bench'),
+        }
+    return game
+
+
+def frame(game, rng, next_key):
+    """Jiggle everything about, and replace a few entities with new ones."""
+    for key, entity in game.query(IngameObject, Collidable):
+        x, y = entity[IngameObject].position
+        entity[IngameObject].position = (x + rng.uniform(-4, 4), y + rng.uniform(-4, 4))
+    for key in rng.sample(list(game.entities.keys()), 5):
+        entity = game.entities[key]
+        del game.entities[key]
+        game.entities[next_key] = entity
+        next_key += 1
+
+    game.collisionSystem.update(game, 0, [])
+    return next_key
+
+
+def run(name, collisionSystem, size, area, frames, seed=0):
+    rng = random.Random(seed)
+    game = build_game(collisionSystem, size, area, rng)
+    next_key = size
+    # Everything starts colliding on the first frame, don't count that
+    next_key = frame(game, rng, next_key)
+
+    start = time.perf_counter()
+    for i in range(frames):
+        next_key = frame(game, rng, next_key)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'bench': 'collisions',
+        'lookup': name,
+        'entities': len(game.entities),
+        'active_events': len(collisionSystem.events),
+        'frames': frames,
+        'ms_per_frame': elapsed * 1000 / frames,
+    }
+
+
+if __name__ == '__main__':
+    # 500 entities packed in tightly enough that each touches a handful of others
+    results = [
+        run('legacy', LegacyCollisionSystem(), 500, 1000, 5),
+        run('pair', CollisionSystem(), 500, 1000, 50),
+    ]
+    results.append({
+        'bench': 'collisions',
+        'speedup': results[0]['ms_per_frame'] / results[1]['ms_per_frame'],
+    })
+    for result in results:
+        print(json.dumps(result))
@@ -0,0 +1,182 @@
+"""Compares how many bytes a host sends each tick with whole-component snapshots
+(how we used to do it) and with delta snapshots, and how many each player
+gets when they only hear about what's near them.
+
+Run from the untangled-2018 folder:
+    python -m bench.network_bytes
+"""
+import json
+import os
+import random
+import uuid
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import bson
+
+from bench.world import BenchFramework, OfflineNetwork
+from game.components import *
+from game.entities import *
+from game.game import GameState
+from lib.network import Network
+from lib.world import World
+
+DIRECTIONS = ['left', 'right', 'up', 'down']
+
+
+class BenchGame:
+    """Just enough of a GameState to hold entities."""
+    add_entity = GameState.add_entity
+    query = GameState.query
+    framework = BenchFramework
+
+    def __init__(self):
+        self.entities = World()
+
+
+class PeerNode:
+    """Pretends to be in a group with some peers, counting what we whisper them."""
+
+    def __init__(self, peers):
+        self.peers = peers
+        self.sent = {peer: 0 for peer in peers}
+
+    def peers_by_group(self, group):
+        return self.peers
+
+    def whisper(self, peer, data):
+        self.sent[peer] += len(data)
+
+
+class InterestNetwork(OfflineNetwork):
+    """Hosts for peers that aren't there, sending each only what's near them."""
+
+    def __init__(self, peers):
+        super().__init__()
+        self.node = PeerNode(peers)
+
+    def get_our_group(self):
+        return 'bench'
+
+    def push_game(self, game):
+        Network.push_game(self, game)
+
+
+def build_game(size, rng):
+    game = BenchGame()
+    game.add_entity(create_map('assets/maps/boi.tmx'))
+    game.add_entity(create_clock())
+    for i in range(4):
+        player = create_player(i, {})
+        player[0].position = (rng.randrange(4000), rng.randrange(4000))
+        game.add_entity(player)
+    factories = [
+        lambda pos: create_zombie(game, pos),
+        create_skeleton,
+        create_bounce,
+        create_sheep,
+        create_chicken,
+        lambda pos: create_test_item_object('wheat', 1, pos),
+    ]
+    for i in range(size):
+        pos = (rng.randrange(4000), rng.randrange(4000))
+        game.add_entity(factories[i % len(factories)](pos))
+    return game
+
+
+def tick(game, rng):
+    """Roughly what UserInputSystem, AI_system and AnimalSystem change every frame.
+
+    Returns every component that was assigned to, as we used to count that as
+    a change even if nothing was different."""
+    touched = []
+    players = [entity[IngameObject].position for key, entity in game.query(PlayerControl, IngameObject)]
+    for key, entity in game.query(PlayerControl, IngameObject):
+        x, y = entity[IngameObject].position
+        entity[IngameObject].position = (x + 10, y)
+        touched.append(entity[IngameObject])
+    for key, entity in game.query(ChasePlayer, IngameObject):
+        x, y = entity[IngameObject].position
+        # They only chase players within 500px
+        if any(abs(x - px) < 500 and abs(y - py) < 500 for px, py in players):
+            entity[IngameObject].position = (x + rng.uniform(-2, 2), y + rng.uniform(-2, 2))
+            entity[Directioned] = Directioned(direction=rng.choice(DIRECTIONS))
+            entity[SpriteSheet].moving = True
+            touched.append(entity[IngameObject])
+        else:
+            entity[SpriteSheet].moving = False
+        touched.append(entity[SpriteSheet])
+    for key, entity in game.query(MoveRandom, IngameObject):
+        # They move every quarter of a second
+        if rng.randrange(15) == 0:
+            x, y = entity[IngameObject].position
+            entity[IngameObject].position = (x + 10, y)
+            entity[Directioned].direction = rng.choice(DIRECTIONS)
+            touched.extend([entity[IngameObject], entity[Directioned]])
+    return touched
+
+
+def legacy_snapshot(game, touched):
+    """What push_game sent before delta snapshots, when hosting."""
+    touched = set(map(id, touched))
+    entities = {
+        'ids': [],
+        'components': {}
+    }
+    for key, entity in game.entities.items():
+        changed_comps = {}
+        for component in entity.values():
+            if component.is_networked() and (component.has_changed() or id(component) in touched):
+                changed_comps[component.get_name()] = component.as_dict()
+        entities['ids'].append(key)
+        entities['components'][str(key)] = changed_comps
+    return entities
+
+
+def run(size, ticks=120, seed=0):
+    rng = random.Random(seed)
+    game = build_game(size, rng)
+    net = OfflineNetwork()
+
+    # Everything is new on the first tick, in both cases
+    initial = len(bson.dumps(legacy_snapshot(game, [])))
+    net.snapshot_game(game)
+
+    legacy = 0
+    delta = 0
+    for i in range(ticks):
+        touched = tick(game, rng)
+        legacy += len(bson.dumps(legacy_snapshot(game, touched)))
+        delta += len(bson.dumps(net.snapshot_game(game)))
+
+    # The same again, but sending each player only what's near them
+    rng = random.Random(seed)
+    game = build_game(size, rng)
+    peers = []
+    for key, entity in game.query(PlayerControl):
+        peers.append(uuid.UUID(int=rng.getrandbits(128)))
+        entity[PlayerControl].player_id = peers[-1]
+    net = InterestNetwork(peers)
+    net.push_game(game)
+    net.node.sent = {peer: 0 for peer in peers}
+    for i in range(ticks):
+        tick(game, rng)
+        net.push_game(game)
+    interest = sum(net.node.sent.values()) / len(peers)
+
+    return {
+        'bench': 'network_bytes',
+        'entities': len(game.entities),
+        'ticks': ticks,
+        'initial_bytes': initial,
+        'legacy_bytes_per_tick': legacy / ticks,
+        'delta_bytes_per_tick': delta / ticks,
+        'reduction': legacy / delta,
+        'interest_bytes_per_player_tick': interest / ticks,
+        'interest_reduction': delta / interest,
+    }
+
+
+if __name__ == '__main__':
+    for size in (100, 1000):
+        print(json.dumps(run(size)))
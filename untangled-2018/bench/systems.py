@@ -0,0 +1,104 @@
+"""Times each system's update, collision checks and network snapshots on
+worlds of 100, 1k and 10k entities, without a window. Snapshots are what
+the host sends the other players, each only hearing about what's near them.
+
+Run from the untangled-2018 folder:
+    python -m bench.systems [--sizes 100 1000 10000] [--frames 60] [--out results.json]
+
+Prints one JSON object per line for everything timed at each size, which
+--out also saves as a list, so results can be compared between commits.
+"""
+import argparse
+import json
+import subprocess
+
+import bson
+
+from bench.world import build_game
+
+# Frames to run before timing anything, so caches are warm
+WARMUP = 5
+# How often to time a full snapshot, as it's slow on big worlds
+FULL_SNAPSHOT_EVERY = 20
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(size, frames, seed=0):
+    game = build_game(size, seed)
+    profiler = game.framework.profiler
+    net = game.net
+    dt = 1.0 / game.framework.fps
+    peers = net.get_peers(game)
+
+    for i in range(WARMUP):
+        game.update(dt, [])
+        game.tick()
+    profiler.timings.clear()
+    profiler.calls.clear()
+
+    ticks_per_frame = game.framework.tick_rate / game.framework.fps
+    ticks = 0.0
+    for frame in range(frames):
+        # Each system on its own, in the order the game runs them
+        for system in game.systems:
+            with profiler.measure(type(system).__name__):
+                system.update(game, dt, [])
+
+        # Finding collisions, without carrying them on
+        collisionSystem = game.collisionSystem
+        with profiler.measure('checkCollisions'):
+            collisionSystem.checkCollisions(game, collisionSystem.get_collidables(game))
+
+        # What we'd send everyone else, at our tick rate
+        ticks += ticks_per_frame
+        if ticks >= 1:
+            ticks -= 1
+            with profiler.measure('snapshot'):
+                for snapshot in net.snapshot_interests(game, peers).values():
+                    bson.dumps(snapshot)
+        if peers and frame % FULL_SNAPSHOT_EVERY == 0:
+            # What someone joining gets
+            with profiler.measure('full snapshot'):
+                players, positions = net.get_places(game)
+                interest = net.get_interest(game, peers[0], players, positions)
+                bson.dumps(net.snapshot_game(game, full=True, only=interest))
+
+    results = []
+    for name, stats in profiler.get_stats().items():
+        result = {
+            'bench': 'systems',
+            'size': size,
+            'entities': len(game.entities),
+            'seed': seed,
+            'name': name,
+        }
+        result.update(stats)
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='also save every result to this JSON file')
+    args = parser.parse_args()
+
+    commit = get_commit()
+    everything = []
+    for size in args.sizes:
+        for result in run(size, args.frames, args.seed):
+            result['commit'] = commit
+            print(json.dumps(result))
+            everything.append(result)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(everything, f, indent=2)
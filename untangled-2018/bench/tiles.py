@@ -0,0 +1,133 @@
+"""Times moving entities around the real map with get_position, against
+how we used to check tiles (walking each edge, looking every tile up in
+CLEAR_TILES).
+
+Run from the untangled-2018 folder:
+    python -m bench.tiles
+"""
+import json
+import math
+import random
+import time
+
+from game.components import *
+from game.entities import create_map
+from game.systems.userinputsystem import CLEAR_TILES, get_position, get_solidity
+
+# How many moves to time each way
+MOVES = 20000
+
+
+def legacy_get_position(io, hoped_vel, tmap):
+    """get_position as it used to be."""
+    hoped_dist = math.ceil((math.sqrt(hoped_vel[0]**2 + hoped_vel[1]**2)) / tmap[SpriteSheet].tile_size)
+    hoped_vel = (hoped_vel[0] / hoped_dist, hoped_vel[1] / hoped_dist)
+
+    for i in range(hoped_dist):
+        hoped_pos = (io.position[0] + hoped_vel[0], io.position[1] + hoped_vel[1])
+
+        if abs(hoped_vel[0]) > 0:
+            intrusive_x = hoped_pos[0] + math.copysign(io.size[0] / 2, hoped_vel[0])
+            tcollision = False
+
+            y = io.position[1] - io.size[1] / 2
+            while y < io.position[1] + io.size[1] / 2:
+                tile_x = math.floor(intrusive_x / tmap[SpriteSheet].tile_size)
+                tile_y = math.floor(y / tmap[SpriteSheet].tile_size)
+
+                if (tile_y < 0 or tile_y >= tmap[Map].height) or (tile_x < 0 or tile_x >= tmap[Map].width) or tmap[Map].grid[tile_y][tile_x] not in CLEAR_TILES:
+                    tcollision = True
+                    break
+
+                if y != io.position[1] + io.size[1] / 2 - 1 and y + tmap[SpriteSheet].tile_size >= io.position[1] + io.size[1] / 2:
+                    y = io.position[1] + io.size[1] / 2 - 1
+                else:
+                    y += tmap[SpriteSheet].tile_size
+            if tcollision:
+                unintrusive_x = (math.floor(intrusive_x / tmap[SpriteSheet].tile_size) - math.copysign(1, hoped_vel[0])) * tmap[SpriteSheet].tile_size
+                hoped_pos = (unintrusive_x + (tmap[SpriteSheet].tile_size / 2) - math.copysign((io.size[0] - tmap[SpriteSheet].tile_size) / 2, hoped_vel[0]), hoped_pos[1])
+        if abs(hoped_vel[1]) > 0:
+            intrusive_y = hoped_pos[1] + math.copysign(io.size[1] / 2, hoped_vel[1])
+            tcollision = False
+
+            x = io.position[0] - io.size[0] / 2
+            while x < io.position[0] + io.size[0] / 2:
+                tile_y = math.floor(intrusive_y / tmap[SpriteSheet].tile_size)
+                tile_x = math.floor(x / tmap[SpriteSheet].tile_size)
+
+                if (tile_y < 0 or tile_y >= tmap[Map].height) or (tile_x < 0 or tile_x >= tmap[Map].width) or tmap[Map].grid[tile_y][tile_x] not in CLEAR_TILES:
+                    tcollision = True
+                    break
+
+                if x != io.position[0] + io.size[0] / 2 - 1 and x + tmap[SpriteSheet].tile_size >= io.position[0] + io.size[0] / 2:
+                    x = io.position[0] + io.size[0] / 2 - 1
+                else:
+                    x += tmap[SpriteSheet].tile_size
+            if tcollision:
+                unintrusive_y = (math.floor(intrusive_y / tmap[SpriteSheet].tile_size) - math.copysign(1, hoped_vel[1])) * tmap[SpriteSheet].tile_size
+                hoped_pos = (hoped_pos[0], unintrusive_y + (tmap[SpriteSheet].tile_size / 2) - math.copysign((io.size[1] - tmap[SpriteSheet].tile_size) / 2, hoped_vel[1]))
+
+    return hoped_pos
+
+
+def is_clear(io, tmap):
+    """Is nothing solid under an entity already? Nothing should start off stuck in a wall."""
+    tile_size = tmap[SpriteSheet].tile_size
+    solidity = get_solidity(tmap)
+    left = math.floor((io.position[0] - io.size[0] / 2) / tile_size)
+    right = math.floor((io.position[0] + io.size[0] / 2 - 1) / tile_size)
+    top = math.floor((io.position[1] - io.size[1] / 2) / tile_size)
+    bottom = math.floor((io.position[1] + io.size[1] / 2 - 1) / tile_size)
+    return not any(solidity.row_solid(y, left, right) for y in range(top, bottom + 1))
+
+
+def build_moves(tmap, rng):
+    """Entities the sizes of ours at random clear places on the map, each
+    with a move no bigger than the fastest thing we have (the player)."""
+    width = tmap[Map].width * tmap[SpriteSheet].tile_size
+    height = tmap[Map].height * tmap[SpriteSheet].tile_size
+    moves = []
+    while len(moves) < MOVES:
+        io = IngameObject(position=(rng.uniform(0, width), rng.uniform(0, height)), size=rng.choice([(32, 32), (64, 64)]))
+        if not is_clear(io, tmap):
+            continue
+        angle = rng.uniform(0, 2 * math.pi)
+        speed = rng.uniform(1, 10)
+        moves.append((io, (math.cos(angle) * speed, math.sin(angle) * speed)))
+    return moves
+
+
+def run(name, move, tmap, moves):
+    start = time.perf_counter()
+    positions = [move(io, velocity, tmap) for io, velocity in moves]
+    elapsed = time.perf_counter() - start
+    return positions, {
+        'bench': 'tiles',
+        'name': name,
+        'moves': len(moves),
+        'us_per_move': elapsed / len(moves) * 1e6,
+    }
+
+
+if __name__ == '__main__':
+    tmap = {component.__class__: component for component in create_map('assets/maps/boi.tmx')}
+
+    start = time.perf_counter()
+    get_solidity(tmap)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    moves = build_moves(tmap, random.Random(0))
+
+    legacy_positions, legacy = run('legacy', legacy_get_position, tmap, moves)
+    positions, swept = run('swept', get_position, tmap, moves)
+    # We now check Y from where X has moved us to, so going diagonally past a corner can end up differently
+    same = sum(math.isclose(a[0], b[0]) and math.isclose(a[1], b[1]) for a, b in zip(legacy_positions, positions))
+
+    swept['compile_ms'] = compile_ms
+    for result in (legacy, swept):
+        print(json.dumps(result))
+    print(json.dumps({
+        'bench': 'tiles',
+        'speedup': legacy['us_per_move'] / swept['us_per_move'],
+        'same_position': same / len(moves),
+    }))
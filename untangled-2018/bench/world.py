@@ -0,0 +1,109 @@
+"""A real GameState to benchmark with. It has no window and no network, and
+the world is the same every time for a given seed.
+
+Entity keys are still random uuids, so only the order collisions are found
+in can change from run to run.
+"""
+import os
+import random
+import uuid
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+
+from game.components import *
+from game.entities import *
+from game.game import GameState
+from lib.network import Network
+from lib.profiler import Profiler
+
+# Our own id on the network that isn't there
+OFFLINE_ID = '00000000-0000-0000-0000-000000000000'
+
+
+class OfflineNetwork(Network):
+    """Hosts and builds snapshots without ever connecting to anyone."""
+    hosting = True
+
+    def open(self):
+        pass
+
+    def get_id(self) -> str:
+        return OFFLINE_ID
+
+    def get_our_group(self):
+        return None
+
+    def get_messages(self):
+        return []
+
+    def get_peers(self, game):
+        """Everyone else with a player, as if they'd joined over the network."""
+        return [
+            entity[PlayerControl].player_id for key, entity in game.query(PlayerControl)
+            if entity[PlayerControl].player_id != OFFLINE_ID
+        ]
+
+    def push_game(self, game):
+        # Nobody to send them to, but still do the work of describing what each of them can see
+        self.snapshot_interests(game, self.get_peers(game))
+
+
+class BenchFramework:
+    """Just enough of a Framework for a GameState, drawing to a hidden screen."""
+    dimensions = (1024, 824)
+    fps = 60
+    tick_rate = 20
+    headless = False
+
+    def __init__(self, systems=None):
+        pygame.init()
+        self.screen = pygame.display.set_mode(self.dimensions)
+        self.net = OfflineNetwork()
+        self.systems = systems
+        self.profiler = Profiler()
+
+
+def spawn(game, rng, factory, count):
+    """Add count entities from factory(position) at random places on the map."""
+    key, tmap = game.query(Map, SpriteSheet).first()
+    width = tmap[Map].width * tmap[SpriteSheet].tile_size
+    height = tmap[Map].height * tmap[SpriteSheet].tile_size
+    for i in range(count):
+        game.add_entity(factory((rng.randrange(width), rng.randrange(height))))
+
+
+def build_game(size, seed=0, systems=None, players=4):
+    """A hosted GameState with about `size` entities, made the same way every
+    time for the same seed. `systems` picks which systems run, by name."""
+    # GameState spawns its own monsters with the random module
+    random.seed(seed)
+    np.random.seed(seed)
+    rng = random.Random(seed)
+
+    game = GameState(BenchFramework(systems), 'Bench', 'Boy', (0, 255, 0))
+    if systems is None:
+        # Nobody's listening, and it would need the music to be there
+        game.systems = [system for system in game.systems if type(system).__name__ != 'SoundSystem']
+    for i in range(players - 1):
+        game.on_player_join(str(uuid.UUID(int=rng.getrandbits(128))))
+
+    factories = [
+        lambda pos: create_zombie(game, pos),
+        create_skeleton,
+        create_ice_skeleton,
+        create_bounce,
+        create_sheep,
+        create_chicken,
+        create_NPC,
+        lambda pos: create_plant(game, 'wheat', './assets/sprites/wheat.png', pos),
+        lambda pos: create_test_item_object('wheat', 1, pos),
+    ]
+    remaining = max(size - len(game.entities), 0)
+    for i, factory in enumerate(factories):
+        # Share what's left out as evenly as we can
+        spawn(game, rng, factory, remaining // len(factories) + (i < remaining % len(factories)))
+    return game
@@ -1,25 +1,43 @@
 from typing import List
 from typing import Tuple
 from typing import Union
+from array import array
+import hashlib
+import sys
 import time
+import zlib
 from pygame import Rect
 import random, time
 
 from lib.component import component
 from lib.framework import Framework
-from game.systems.collisionsystem import CollisionCall
 from game.systems.particlesystem import Particle
 
 @component(networked=True)
 class IngameObject:
     """Gives an entity a place and size in game."""
-    position: Tuple[int, int]
+    position: Tuple[float, float]
     size: Tuple[int, int]
     id = None
 
     def get_rect(self):
         return Rect(self.position,self.size)
 
+@component()
+class Interpolated:
+    """Smooths out where an entity is drawn between network snapshots."""
+    previous: Tuple[float, float]
+    target: Tuple[float, float]
+    received: float = 0.0
+    duration: float = 0.05
+
+    def get_position(self, now):
+        progress = min((now - self.received) / self.duration, 1.0) if self.duration > 0 else 1.0
+        return (
+            self.previous[0] + (self.target[0] - self.previous[0]) * progress,
+            self.previous[1] + (self.target[1] - self.previous[1]) * progress
+        )
+
 @component(networked=True)
 class Health:
     """Gives the entity health"""
@@ -130,13 +148,47 @@ directionVelocity = {
     'down':[0,1]
 }
 
-@component(networked=True)
+@component()
 class Map:
+    """The tiles of a map. It's never sent to anyone, they load it themselves
+    from the entity's MapAsset."""
     path: str
     width: int
     height: int
     grid: list
 
+    def get_tiles(self) -> bytes:
+        """Every tile, row by row, as little-endian 32-bit ints."""
+        tiles = array('I', (tile for row in self.grid for tile in row))
+        if sys.byteorder == 'big':
+            tiles.byteswap()
+        return tiles.tobytes()
+
+    def get_hash(self) -> str:
+        """Sums up the map's tiles, so we can tell if two maps are the same."""
+        return hashlib.sha1(b'%d,%d:' % (self.width, self.height) + self.get_tiles()).hexdigest()
+
+    def pack(self) -> bytes:
+        return zlib.compress(self.get_tiles())
+
+    @staticmethod
+    def unpack(path, width, height, data):
+        """Make a Map from what pack gave us."""
+        tiles = array('I')
+        tiles.frombytes(zlib.decompress(data))
+        if sys.byteorder == 'big':
+            tiles.byteswap()
+        grid = [tiles[y * width:(y + 1) * width].tolist() for y in range(height)]
+        return Map(path=path, width=width, height=height, grid=grid)
+
+@component(networked=True)
+class MapAsset:
+    """Which map an entity's Map is, by where it is in our assets and its hash.
+    Everyone loads the map from their own assets if it's the same there, and
+    otherwise asks the host for it once and keeps it, see MapSystem."""
+    path: str
+    hash: str
+
 @component(networked=True)
 class Directioned:
     """States that an entity will be pointing in a certain direction.
@@ -227,8 +279,10 @@ class ParticleEmitter:
     _prePosition = (0,0)
     _lastGet = 0
 
-    def getParticles(self,entity):
-        new_particles = []
+    def getParticles(self, entity, particles):
+        """Make any particles due from the entity, straight into the given ParticleSystem.
+        Returns how many were made."""
+        made = 0
         if self.doCreateParticles and IngameObject in entity and self._lastGet + self.cooldown < time.time():
             doParticles = True
             if self.onlyWhenMoving:
@@ -258,7 +312,7 @@ class ParticleEmitter:
                         if self.directionMode == 2:
                             modi = -1
                         vel = (vel[0] * dire[0] * modi, vel[1] * dire[1] * modi)
-                    part = Particle(
+                    if particles.spawn(
                         t,
                         pos,
                         self.lifespan,
@@ -268,10 +322,10 @@ class ParticleEmitter:
                         below = (self.height == "below"),
                         randomness = rand,
                         size = self.size
-                    )
+                    ):
+                        made += 1
                     self._lastGet = time.time()
-                    new_particles.append(part)
-        return new_particles
+        return made
 
 @component(networked=True)
 class Collidable:
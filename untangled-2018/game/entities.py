@@ -87,6 +87,7 @@ def create_map(path):
 
     return [
         map_comp,
+        MapAsset(path=path, hash=map_comp.get_hash()),
         SpriteSheet(
             tile_size=32,
             path="assets/tilesets/tilemap.png",
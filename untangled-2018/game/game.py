@@ -15,6 +15,7 @@ from game.systems.userinputsystem import UserInputSystem
 from game.systems.profilesystem import ProfileSystem
 from game.systems.animalsystem import AnimalSystem
 from game.systems.AI_system import AI_system
+from game.systems.mapsystem import MapSystem
 from game.systems.collisionsystem import CollisionSystem, CollisionCall
 from game.systems.particlesystem import ParticleSystem
 from game.systems.soundsystem import SoundSystem
@@ -26,6 +27,10 @@ from game.systems.plantsystem import PlantSystem
 from game.systems.damagesystem import DamageSystem
 from game.systems.inventorysystem import *
 from game.collisions import Class_Collisions
+from lib.world import World
+
+# Systems that are only any use with a window, speakers and a player of our own
+HEADLESS_SKIPPED = ('RenderSystem', 'ParticleSystem', 'SoundSystem', 'UserInputSystem')
 
 
 
@@ -45,17 +50,19 @@ class GameState:
       * CurrencySystem
     """
 
-    entities = {}
+    entities = None
     systems = []
     collisionSystem = None
 
     def __init__(self, framework, name, gender, colour):
         """Creates a GameState to fit our framework, with some information about ourselves."""
         self.framework = framework
+        self.entities = World()
         self.screen = framework.screen
         self.net = framework.net
         self.renderSystem = RenderSystem(self.screen,self.framework)
         self.collisionSystem = CollisionSystem()
+        self.entities.on_delete.append(self.collisionSystem.on_entity_deleted)
         self.inventorySystem = InventorySystem()
         self.particles = ParticleSystem(self.renderSystem)
 
@@ -66,7 +73,9 @@ class GameState:
 
 
         # Add all systems we want to run
+        self.systems = []
         self.systems.extend([
+            MapSystem(),
             self.plantsystem,
             ProfileSystem(name, gender, colour),
             UserInputSystem(),
@@ -84,11 +93,19 @@ class GameState:
             TimeSystem()
         ])
 
+        if framework.systems is not None:
+            self.systems = [system for system in self.systems if type(system).__name__ in framework.systems]
+        elif framework.headless:
+            self.systems = [system for system in self.systems if type(system).__name__ not in HEADLESS_SKIPPED]
+        # Nothing would clean up particles we never draw
+        self.particles.enabled = self.particles in self.systems
+
         if self.net.is_hosting():
             map_ent = self.entities[self.add_entity(create_map('assets/maps/boi.tmx'))]
 
             # If we're hosting, we need to register that we joined our own game
-            self.on_player_join(self.net.get_id())
+            if not framework.headless:
+                self.on_player_join(self.net.get_id())
 
             # If we're hosting, we need to register that we joined our own game
             self.add_entity(create_wand())
@@ -157,15 +174,33 @@ class GameState:
         """This code gets run 60fps. All of our game logic stems from updating
         our systems on our entities."""
 
+        profiler = self.framework.profiler
+
         # Update ourselves from the network
-        self.net.pull_game(self)
+        with profiler.measure('pull_game'):
+            self.net.pull_game(self)
 
         # Update our systems
         for system in self.systems:
-            system.update(self, dt, events)
+            with profiler.measure(type(system).__name__):
+                system.update(self, dt, events)
+
+        # How much there is of what makes us slow
+        profiler.count('entities', len(self.entities))
+        profiler.count('particles', len(self.particles.pool))
+        profiler.count('collision events', len(self.collisionSystem.events))
+
+    def get_dirty_rects(self):
+        """The parts of the screen we've changed this frame, or None for all of it."""
+        return self.renderSystem.get_dirty_rects()
+
+    def tick(self):
+        """This code gets run at the framework's tick rate, less often than
+        update. Everything we've changed since the last tick goes out at once."""
 
         # Send our changes to everyone else
-        self.net.push_game(self)
+        with self.framework.profiler.measure('push_game'):
+            self.net.push_game(self)
 
 
     def on_player_join(self, player_id):
@@ -203,8 +238,8 @@ class GameState:
         """This code gets run whever a player exits the game."""
         # Remove any entities tied to them - e.g. the player they control
         tied = []
-        for key, entity in list(self.entities.items()):
-            if PlayerControl in entity and entity[PlayerControl].player_id == player_id:
+        for key, entity in self.query(PlayerControl):
+            if entity[PlayerControl].player_id == player_id:
                 del self.entities[key]
 
 
@@ -217,6 +252,14 @@ class GameState:
             self.entities[key][IngameObject].id = key
         return key
 
+    def query(self, *components):
+        """Get (key, entity) for every entity that has all of the given
+        components, without having to look at every entity we have.
+
+        The result is kept up to date as entities and components are added
+        and removed, so it's cheap to ask for the same thing every frame."""
+        return self.entities.query(*components)
+
     def itemPickedUp(self, event):
         pass
 
@@ -3,89 +3,185 @@ from pygame import Rect
 import math
 from lib.system import System
 from game.components import *
-from game.systems.userinputsystem import get_position
+from game.systems.lod import LODScheduler
+from game.systems.userinputsystem import get_position, get_solidity
+from collections import deque
+
+import numpy as np
+
+# How close a player has to be for monsters to chase them, in pixels
+AGGRO_RADIUS = 500
+# How far around a player their flow field goes, compared to how far
+# monsters chase from, as the way around walls can be longer
+FLOW_FIELD_REACH = 2
+# How often monsters are updated by how far they are from a player, see LODScheduler.
+# Monsters too far to chase only need to notice they've stopped
+LOD_BANDS = ((AGGRO_RADIUS * 1.5, 1), (AGGRO_RADIUS * 3, 4))
+# ChasePlayer speeds are how far monsters go in a frame at 60fps
+FRAME_TIME = 1 / 60
+
+# Every way we can step from one tile to the next
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+class FlowField:
+    """Which way to go from every tile around a target tile to get to it,
+    going around any solid tile.
+
+    Worked out once by searching outwards from the target, after that any
+    number of monsters can look up which way to go without searching."""
+
+    def __init__(self, solidity, target, radius):
+        self.solidity = solidity
+        self.tile_size = solidity.tile_size
+        self.target = target
+
+        # The tiles we search over, with a border of walls around them so we never step off
+        self.left = max(target[0] - radius, 0) - 1
+        self.top = max(target[1] - radius, 0) - 1
+        right = min(target[0] + radius + 1, solidity.width)
+        bottom = min(target[1] + radius + 1, solidity.height)
+        self.width = right - self.left + 1
+        self.height = bottom - self.top + 1
+        window = np.zeros((self.height, self.width), dtype=bool)
+        solid = np.frombuffer(solidity.solid, dtype=np.uint8).reshape(solidity.height, solidity.width)
+        window[1:-1, 1:-1] = solid[self.top + 1:bottom, self.left + 1:right] == 0
+        clear = window.ravel().tolist()
+
+        # Each tile, as an index into the window -> the next one on the way to the target
+        width = self.width
+        steps = [(dx + dy * width, dx, dy * width) for dx, dy in NEIGHBOURS]
+        start = self.get_index(target)
+        self.next_tile = {start: start}
+        next_tile = self.next_tile
+
+        # Breadth-first out from the target, so every tile points back the shortest way
+        frontier = deque([start])
+        while frontier:
+            index = frontier.popleft()
+            for step, dx, dy in steps:
+                tile = index + step
+                if tile in next_tile or not clear[tile]:
+                    continue
+                if dx != 0 and dy != 0 and not (clear[index + dx] and clear[index + dy]):
+                    # Don't cut corners
+                    continue
+                next_tile[tile] = index
+                frontier.append(tile)
+
+    def get_tile(self, position):
+        return (math.floor(position[0] / self.tile_size), math.floor(position[1] / self.tile_size))
+
+    def get_index(self, tile):
+        x = tile[0] - self.left
+        y = tile[1] - self.top
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return x + y * self.width
+        return None
+
+    def get_waypoint(self, position):
+        """Where to head for from a position to get to the target: the middle
+        of the next tile, or None if we're already there or can't get there."""
+        tile = self.get_tile(position)
+        if tile == self.target:
+            return None
+        index = self.next_tile.get(self.get_index(tile))
+        if index is None:
+            return None
+        x = index % self.width + self.left
+        y = index // self.width + self.top
+        return ((x + 0.5) * self.tile_size, (y + 0.5) * self.tile_size)
 
 class AI_system(System):
+    def __init__(self):
+        # Every player's flow field, by their key
+        self.flow_fields = {}
+        # Which monsters to update each frame
+        self.lod = LODScheduler(LOD_BANDS)
+
+    def get_flow_field(self, key, position, tmap):
+        """Get a player's flow field, only working it out again if they've moved to another tile."""
+        solidity = get_solidity(tmap)
+        tile_size = solidity.tile_size
+        field = self.flow_fields.get(key)
+        if field is None or field.solidity is not solidity or field.get_tile(position) != field.target:
+            target = (math.floor(position[0] / tile_size), math.floor(position[1] / tile_size))
+            radius = math.ceil(AGGRO_RADIUS * FLOW_FIELD_REACH / tile_size)
+            field = FlowField(solidity, target, radius)
+            self.flow_fields[key] = field
+        return field
+
     def update(self, game, dt: float, events: list):
         ZOM_center = (0, 0)
 
         # Find and get the tilemap, if it exists
-        tmap = None
-        for key, entity in game.entities.items():
-            if Map in entity and SpriteSheet in entity:
-                tmap = entity
-                break
-
-        for key, entity in game.entities.items():
-            #We find all AI entities
-            if ChasePlayer in entity and IngameObject in entity:
-                # this is a list of all player locations
-                player_locations = []
-                for  e_key, e_entity in game.entities.items():
-                    if PlayerControl in e_entity and IngameObject in e_entity:
-                        # add player location into list of locations
-                        player_locations.append(e_entity[IngameObject].position)
-
-
-                # for each player location find the one that is the closest
-                smallest_distance = None
-                e_place = None
-                place = entity[IngameObject].position
-                # loop over player_locations
-                for loc in player_locations:
-                    x_diff = place[0] - loc[0]
-                    y_diff = place[1] - loc[1]
+        tmap_key, tmap = game.query(Map, SpriteSheet).first()
+
+        # Bucket where all the players are, they don't change while monsters move
+        self.lod.begin(game, dt)
+
+        # Forget the flow fields of players that have gone
+        for e_key in list(self.flow_fields.keys()):
+            if e_key not in game.entities:
+                del self.flow_fields[e_key]
+
+        #We find all AI entities
+        for key, entity in game.query(ChasePlayer, IngameObject):
+            place = entity[IngameObject].position
+            elapsed = self.lod.due(key, place)
+            if elapsed == None:
+                continue
+
+            # find the closest player close enough to chase
+            nearest = self.lod.players.nearest(place, AGGRO_RADIUS)
+
+            if nearest == None:
+                if SpriteSheet in entity:
+                    entity[SpriteSheet].moving = False
+            else:
+                e_key, e_place, smallest_distance = nearest
+                #Finds the difference between the player place and the monster place
+                x_diff = place[0] - e_place[0]
+                y_diff = place[1] - e_place[1]
+                #e_place is player place, place is enemy place
+                #Calculates the hypotonuese of the player and the monster to allow the monster to move diagonally
+                if abs(x_diff) > 15 or abs(y_diff) > 15:
+                    if tmap != None:
+                        # Follow the player's flow field around walls, until we're on their tile
+                        waypoint = self.get_flow_field(e_key, e_place, tmap).get_waypoint(place)
+                        if waypoint != None:
+                            x_diff = place[0] - waypoint[0]
+                            y_diff = place[1] - waypoint[1]
                     distance = math.sqrt(x_diff**2+y_diff**2)
-                    if x_diff < 500 and y_diff < 500:
-                        if smallest_distance == None or distance < smallest_distance:
-                            smallest_distance = distance
-                            e_place = loc
-
-
-                    # find out the distance between the entity and the player
-                    # if the player location is less than the closest_location value
-                    # set closest_location to the player location
-
-                    if smallest_distance == None:
-                        if SpriteSheet in entity:
-                            entity[SpriteSheet].moving = False
-                    
-                    #Finds the difference between the player place and the monster place
-                    if e_place != None:
-                        place = entity[IngameObject].position
-                        x_diff = place[0] - e_place[0]
-                        y_diff = place[1] - e_place[1]
-                        #e_place is player place, place is enemy place
-                        #Calculates the hypotonuese of the player and the monster to allow the monster to move diagonally
-                        if abs(x_diff) > 15 or abs(y_diff) > 15:
-                            distance = math.sqrt(x_diff**2+y_diff**2)
-                            speed = entity[ChasePlayer].speed
-                            velo = (-x_diff/distance*speed, -y_diff/distance*speed)
-                            if tmap == None:
-                                position = (entity[IngameObject].position[0] + velo[0], entity[IngameObject].position[1] + velo[1])
-                            else:
-                                position = get_position(entity[IngameObject], velo, tmap)
-
-                            entity[IngameObject].position = position
-                            if SpriteSheet in entity:
-                                entity[SpriteSheet].moving = True
-                            if ParticleEmitter in entity:
-                                if entity[ParticleEmitter].onlyWhenMoving:
-                                    entity[ParticleEmitter].doCreateParticles = True
-
-                            #Changes the direction of the monster
-                            if abs(x_diff) > abs(y_diff):
-                                if e_place[0] >= place[0]:
-                                    direction = Directioned(direction='right')
-                                else:
-                                    direction = Directioned(direction='left')
-                            else:
-                                if e_place[1] >= place[1]:
-                                    direction = Directioned(direction='down')
-                                else:
-                                    direction = Directioned(direction='up')
-                            if Directioned in entity:
-                                entity[Directioned] = direction
+                    speed = entity[ChasePlayer].speed * elapsed / FRAME_TIME
+                    if distance > 0:
+                        velo = (-x_diff/distance*speed, -y_diff/distance*speed)
+                    else:
+                        velo = (0, 0)
+                    if tmap == None:
+                        position = (entity[IngameObject].position[0] + velo[0], entity[IngameObject].position[1] + velo[1])
+                    else:
+                        position = get_position(entity[IngameObject], velo, tmap)
+
+                    entity[IngameObject].position = position
+                    if SpriteSheet in entity:
+                        entity[SpriteSheet].moving = True
+                    if ParticleEmitter in entity:
+                        if entity[ParticleEmitter].onlyWhenMoving:
+                            entity[ParticleEmitter].doCreateParticles = True
+
+                    #Changes the direction of the monster to the way it's going
+                    if abs(x_diff) > abs(y_diff):
+                        if velo[0] >= 0:
+                            direction = Directioned(direction='right')
+                        else:
+                            direction = Directioned(direction='left')
+                    else:
+                        if velo[1] >= 0:
+                            direction = Directioned(direction='down')
                         else:
-                            if SpriteSheet in entity:
-                                entity[SpriteSheet].moving = False
+                            direction = Directioned(direction='up')
+                    if Directioned in entity:
+                        entity[Directioned] = direction
+                else:
+                    if SpriteSheet in entity:
+                        entity[SpriteSheet].moving = False
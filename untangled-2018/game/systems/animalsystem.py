@@ -6,18 +6,26 @@ import time
 from lib.system import System
 from game.components import *
 from game.systems.userinputsystem import get_position
+from game.systems.lod import LODScheduler
+
+# How often animals are updated by how far they are from a player, see LODScheduler.
+# They only move every so often anyway, so being a few frames late doesn't show
+LOD_BANDS = ((800, 1), (1600, 4), (3200, 16))
 
 class AnimalSystem(System):
+    def __init__(self):
+        # Which animals to update each frame
+        self.lod = LODScheduler(LOD_BANDS)
+
     def update(self, game, dt: float, events: list):
         # Find and get the tilemap, if it exists
-        tmap = None
-        for key, entity in game.entities.items():
-            if Map in entity and SpriteSheet in entity:
-                tmap = entity
-                break
+        tmap_key, tmap = game.query(Map, SpriteSheet).first()
+        self.lod.begin(game, dt)
 
-        for key, entity in game.entities.items():
-            if MoveRandom in entity and time.time() - entity[MoveRandom].lastmove > 0.25:
+        for key, entity in game.query(MoveRandom, IngameObject):
+            if self.lod.due(key, entity[IngameObject].position) == None:
+                continue
+            if time.time() - entity[MoveRandom].lastmove > 0.25:
                 direct = ['left', 'right', 'up', 'down']
                 dire = random.choice(direct)
                 velo = {
@@ -28,7 +36,11 @@ class AnimalSystem(System):
                 }[dire]
 
 
-                animal_center = get_position(entity[IngameObject], velo, tmap)
+                if tmap == None:
+                    # No map yet, e.g. it's still on its way from the host
+                    animal_center = (entity[IngameObject].position[0] + velo[0], entity[IngameObject].position[1] + velo[1])
+                else:
+                    animal_center = get_position(entity[IngameObject], velo, tmap)
                 entity[IngameObject].position = animal_center
 
                 if SpriteSheet in entity:
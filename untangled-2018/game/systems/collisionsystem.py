@@ -1,35 +1,138 @@
 from typing import Tuple
 from lib.system import System
+from game.components import *
 import math
 
+# How many map tiles wide and high each spatial hash cell is
+CELL_TILES = 4
+# Cell size to use if there's no map to base it on
+DEFAULT_CELL_SIZE = 128
+
+class SpatialHash:
+    """Buckets rects into a grid of cells, so we only need to compare rects
+    that share a cell instead of every rect with every other rect."""
+
+    def __init__(self, cell_size: int):
+        self.cell_size = cell_size
+        # (cell x, cell y) -> keys of everything touching that cell
+        self.cells = {}
+        # key -> the range of cells it touches, and its rect
+        self.bounds = {}
+        self.rects = {}
+
+    def get_bounds(self, rect):
+        return (
+            rect.left // self.cell_size,
+            rect.top // self.cell_size,
+            (rect.right - 1) // self.cell_size,
+            (rect.bottom - 1) // self.cell_size
+        )
+
+    def update(self, key, rect):
+        """Add something, or tell us it's moved."""
+        bounds = self.get_bounds(rect)
+        self.rects[key] = rect
+        if self.bounds.get(key) == bounds:
+            # Still in the same cells, nothing to move
+            return
+        if key in self.bounds:
+            self.remove_from_cells(key)
+        self.bounds[key] = bounds
+        for cell in self.get_cells(bounds):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        if key in self.bounds:
+            self.remove_from_cells(key)
+            del self.bounds[key]
+            del self.rects[key]
+
+    def remove_from_cells(self, key):
+        for cell in self.get_cells(self.bounds[key]):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def get_cells(self, bounds):
+        min_x, min_y, max_x, max_y = bounds
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                yield (x, y)
+
+    def get_pairs(self):
+        """Every pair of keys that share at least one cell, each pair once."""
+        pairs = set()
+        for keys in self.cells.values():
+            if len(keys) < 2:
+                continue
+            keys = sorted(keys)
+            for i, a in enumerate(keys):
+                for b in keys[i + 1:]:
+                    pairs.add((a, b))
+        return pairs
+
+def pair_key(keys) -> tuple:
+    """The same key for a pair of entities, whichever way round they're given."""
+    a, b = keys
+    return (a, b) if a <= b else (b, a)
+
 class CollisionSystem(System):
     # Structure :
-    # COLLISIONEVENTS.append(CollisionCall())
-    # called for both entities
-    COLLISIONEVENTS = []
+    # events[pair_key(keys)] = CollisionEvent()
+    # calls made for both entities
     # key is entity key
     COLLISIONCALLS = {}
 
+    def __init__(self):
+        self.grid = SpatialHash(DEFAULT_CELL_SIZE)
+        # Ongoing collisions, by the pair of entities colliding
+        self.events = {}
+        # Entity key -> pairs it's currently colliding in
+        self.entity_events = {}
+
     def distanceBetween(posA: Tuple[int,int], posB: Tuple[int,int]):
         x = abs(posA[0] - posB[0])
         y = abs(posA[1] - posB[1])
         dis = math.sqrt(x**2 + y**2)
         return dis
 
-    def checkCollisions(self, game, key, collidable, others: list):
-        if others == None:
-            return
-        for against in others:
-            if key == against[0]:
-                continue
-            else:
-                rectA = collidable.toRect(game.entities[key])
-                rectB = against[1].toRect(game.entities[against[0]])
-                keys = [key, against[0]]
-                if rectA.colliderect(rectB):
-                    self.createCollision(game, keys)
-                else:
-                    self.endCollision(keys)
+    def get_cell_size(self, game):
+        # Cells are a few map tiles big
+        tmap_key, tmap = game.query(Map, SpriteSheet).first()
+        if tmap is None:
+            return DEFAULT_CELL_SIZE
+        tile_size = tmap[SpriteSheet].tile_size
+        if isinstance(tile_size, tuple):
+            tile_size = max(tile_size)
+        return tile_size * CELL_TILES
+
+    def checkCollisions(self, game, collidables: list):
+        """Start and end collisions between the given (key, entity) pairs."""
+        cell_size = self.get_cell_size(game)
+        if cell_size != self.grid.cell_size:
+            self.grid = SpatialHash(cell_size)
+
+        # Move everything to where it is now, and forget what's gone
+        checked = set()
+        for key, entity in collidables:
+            self.grid.update(key, entity[Collidable].toRect(entity))
+            checked.add(key)
+        for key in list(self.grid.bounds.keys()):
+            if key not in checked:
+                self.grid.remove(key)
+
+        # Only look closely at things that are near each other
+        colliding = set()
+        for a, b in self.grid.get_pairs():
+            if self.grid.rects[a].colliderect(self.grid.rects[b]):
+                colliding.add((a, b))
+                self.createCollision(game, [a, b])
+
+        # Anything that was colliding but isn't anymore has ended
+        for pair, event in self.events.items():
+            if pair not in colliding:
+                event.doEnd = True
 
 
     def endCollision(self, keys):
@@ -40,8 +143,33 @@ class CollisionSystem(System):
 
     def createCollision(self,game,keys: list):
         #Collide the entities
-        if self.collisionExists(keys) is None:
-            self.COLLISIONEVENTS.append(CollisionEvent(game, self, keys))
+        pair = pair_key(keys)
+        if pair not in self.events:
+            event = CollisionEvent(game, self, list(pair))
+            self.events[pair] = event
+            for key in pair:
+                self.entity_events.setdefault(key, set()).add(pair)
+                if key not in game.entities:
+                    # Deleted as the collision started
+                    event.doKill = True
+
+    def removeEvent(self, pair):
+        event = self.events.pop(pair)
+        for key in pair:
+            pairs = self.entity_events.get(key)
+            if pairs is not None:
+                pairs.discard(pair)
+                if not pairs:
+                    del self.entity_events[key]
+        event.calls = []
+
+    def on_entity_deleted(self, key):
+        """Kill everything the entity was colliding with, it's gone now."""
+        for pair in self.entity_events.pop(key, ()):
+            event = self.events.get(pair)
+            if event is not None:
+                event.doKill = True
+        self.grid.remove(key)
 
     def allExcept(self, exclude, l: list):
         ret = []
@@ -51,32 +179,34 @@ class CollisionSystem(System):
         return ret
 
     def collisionExists(self, keys: list):
-        for e in self.COLLISIONEVENTS:
-            c = 0
-            for x in keys:
-                if x in e.keys:
-                    c += 1
-            if c >= len(keys):
-                return e
-        return None
-
-    #Must be called before render
+        return self.events.get(pair_key(keys))
+
+    def get_collidables(self, game):
+        """Everything that can currently collide, on screen or not."""
+        collidables = []
+        for key, entity in game.query(Collidable, IngameObject):
+            # Don't check for items being picked up
+            if CanPickUp in entity and entity[CanPickUp].pickedUp:
+                continue
+            if entity[Collidable].canCollide:
+                collidables.append((key, entity))
+        return collidables
+
     def update(self, game, dt, events):
-        remove = []
-        for c in self.COLLISIONEVENTS:
+        # Carry on with last frame's collisions first, so they get a frame
+        # to start before being updated
+        # Copy, as callbacks may delete entities and so kill events
+        for pair, c in list(self.events.items()):
             if c.doKill:
-                remove.append(c)
+                self.removeEvent(pair)
                 continue
             if c.doEnd:
                 c.end()
-                remove.append(c)
+                self.removeEvent(pair)
             else:
                 c.update()
-        for r in remove:
-            self.COLLISIONEVENTS.remove(r)
-            r.calls = []
-            del(r)
-        remove = []
+
+        self.checkCollisions(game, self.get_collidables(game))
 
 
 class CollisionEvent:
@@ -126,11 +256,8 @@ class CollisionEvent:
                 c.onCollisionEnd(self.game, self)
 
     def isValid(self):
-        for k in self.keys:
-            if k not in self.game.entities:
-                self.doKill = True
-                return False
-        return True
+        # The CollisionSystem kills us as soon as either entity is deleted
+        return not self.doKill
 
 class CollisionCall:
     def __init__(self, start=None, update=None, end=None):
@@ -7,8 +7,8 @@ import math, time
 
 class DamageSystem(System):
     def update(self, game, dt, events):
-        for key, entity in dict(game.entities).items():
-            if Health in entity and PlayerControl not in entity:
+        for key, entity in game.query(Health):
+            if PlayerControl not in entity:
                 if entity[Health].value <= 0:
                     del game.entities[key]
 
@@ -0,0 +1,79 @@
+from lib.spatial import PointGrid
+from game.components import *
+
+# How often to work out again how far things are from the players, in frames
+REBAND_EVERY = 16
+
+
+class LODScheduler:
+    """Decides which entities are worth updating this frame, by how far they
+    are from the nearest player.
+
+    bands is a list of (distance, every), nearest first: anything within
+    distance of a player gets updated every `every` frames, and anything
+    further than the last band sleeps until a player comes near. Entities
+    in the same band are spread out over the frames, so they don't all
+    update at once.
+
+    Anything we update less than every frame gets told how long it's been,
+    so it can move as far as it would have."""
+
+    def __init__(self, bands):
+        self.bands = bands
+        self.frame = 0
+        self.time = 0.0
+        self.dt = 0.0
+        # Where the players are this frame
+        self.players = PointGrid(bands[-1][0])
+        # key -> which frames it's updated on, spread out as they're added
+        self.slots = {}
+        self.next_slot = 0
+        # key -> how many frames between its updates, 0 if it's asleep
+        self.every = {}
+        # key -> our time when we last updated it
+        self.last = {}
+
+    def begin(self, game, dt: float):
+        """Call at the start of each frame, before asking what's due."""
+        self.frame += 1
+        self.time += dt
+        self.dt = dt
+
+        self.players.clear()
+        for key, entity in game.query(PlayerControl, IngameObject):
+            self.players.add(key, entity[IngameObject].position)
+
+        if self.frame % REBAND_EVERY == 0:
+            # Forget anything that's gone
+            for key in [key for key in self.slots if key not in game.entities]:
+                del self.slots[key]
+                self.every.pop(key, None)
+                self.last.pop(key, None)
+
+    def get_every(self, position):
+        nearest = self.players.nearest(position, self.bands[-1][0])
+        if nearest is None:
+            return 0
+        for distance, every in self.bands:
+            if nearest[2] <= distance:
+                return every
+        return 0
+
+    def due(self, key, position):
+        """How long it's been since we last updated this entity, if it should
+        be updated this frame, or None if it should be left alone."""
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = self.next_slot
+            self.next_slot += 1
+
+        if (self.frame + slot) % REBAND_EVERY == 0 or key not in self.every:
+            self.every[key] = self.get_every(position)
+        every = self.every[key]
+        if every == 0 or (self.frame + slot) % every != 0:
+            return None
+
+        # Don't let anything catch up on more than one of its updates, e.g. after sleeping
+        elapsed = min(self.time - self.last.get(key, self.time - self.dt), every * self.dt)
+        self.last[key] = self.time
+        return elapsed
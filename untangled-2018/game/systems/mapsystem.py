@@ -0,0 +1,82 @@
+import os
+import time
+
+from lib.system import System
+from game.components import *
+from game.entities import create_map
+
+# Where we keep maps the host has sent us, by their hash
+MAP_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'untangled', 'maps')
+# How long to wait for the host to send a map before asking again, in seconds
+MAP_REQUEST_TIMEOUT = 5
+
+
+class MapSystem(System):
+    """Gives anything with a MapAsset its Map, as maps aren't sent with
+    everything else. We load it from our own assets if ours is the same map,
+    from our cache if the host has sent it to us before, or else ask the
+    host to send it to us, again if they take too long."""
+
+    def __init__(self):
+        # Hashes of maps we've looked for ourselves and haven't got
+        self.missing = set()
+        # When we last asked the host for each map, by hash
+        self.requested = {}
+
+    def update(self, game, dt: float, events: list):
+        for key, entity in game.query(MapAsset):
+            if Map in entity:
+                continue
+            asset = entity[MapAsset]
+            map = self.load_map(game, asset)
+            if map is not None:
+                entity[Map] = map
+                self.requested.pop(asset.hash, None)
+            elif time.time() - self.requested.get(asset.hash, 0) > MAP_REQUEST_TIMEOUT:
+                self.requested[asset.hash] = time.time()
+                game.net.request_map(asset.hash)
+
+    def load_map(self, game, asset):
+        """The map the asset describes, if we have it. We only look at our
+        own files once, after that we just wait for the host to send it."""
+        if asset.hash not in self.missing:
+            map = self.load_local(asset)
+            if map is not None:
+                return map
+            self.missing.add(asset.hash)
+
+        sent = game.net.received_maps.pop(asset.hash, None)
+        if sent is not None:
+            map = Map.unpack(asset.path, sent['width'], sent['height'], sent['tiles'])
+            if map.get_hash() == asset.hash:
+                self.save_map(asset.hash, sent)
+                return map
+            # Not what we asked for, try again
+            self.requested.pop(asset.hash, None)
+        return None
+
+    def load_local(self, asset):
+        """The map from our own assets or our cache, if either is the right one."""
+        if os.path.exists(asset.path):
+            map = create_map(asset.path)[0]
+            if map.get_hash() == asset.hash:
+                return map
+
+        cached = os.path.join(MAP_CACHE, asset.hash)
+        if os.path.exists(cached):
+            with open(cached, 'rb') as f:
+                width, height, data = f.readline(), f.readline(), f.read()
+            map = Map.unpack(asset.path, int(width), int(height), data)
+            if map.get_hash() == asset.hash:
+                return map
+        return None
+
+    def save_map(self, hash, sent):
+        try:
+            os.makedirs(MAP_CACHE, exist_ok=True)
+            with open(os.path.join(MAP_CACHE, hash), 'wb') as f:
+                f.write(b'%d\n%d\n' % (sent['width'], sent['height']))
+                f.write(sent['tiles'])
+        except OSError:
+            # We'll just have to ask again next time
+            pass
@@ -2,31 +2,134 @@ from typing import Tuple
 from lib.system import System
 import pygame
 import random
+import numpy as np
+
+# Every kind of particle we can draw, by their type id in a ParticlePool
+PARTICLE_TYPES = ('square', 'circle', 'ring', 'star', 'text')
+PARTICLE_TYPE_IDS = {name: index for index, name in enumerate(PARTICLE_TYPES)}
+
+# The most particles we'll have at once, any more aren't made
+MAX_PARTICLES = 10000
+
+class ParticlePool:
+    """Every live particle, stored as columns of NumPy arrays so they can all
+    be moved in one go.
+
+    Live particles are always the first `count` rows: when one dies, a live
+    particle from the end is swapped into its place."""
+
+    def __init__(self, capacity: int = MAX_PARTICLES):
+        self.capacity = capacity
+        self.count = 0
+        self.position = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.acceleration = np.zeros((capacity, 2))
+        self.randomness = np.zeros((capacity, 2))
+        self.lifespan = np.zeros(capacity, dtype=np.int32)
+        self.colour = np.zeros((capacity, 3), dtype=np.uint8)
+        self.type_id = np.zeros(capacity, dtype=np.int8)
+        self.size = np.zeros(capacity, dtype=np.int32)
+        self.below = np.zeros(capacity, dtype=bool)
+        self.text = np.empty(capacity, dtype=object)
+        self.columns = [
+            self.position, self.velocity, self.acceleration, self.randomness, self.lifespan,
+            self.colour, self.type_id, self.size, self.below, self.text
+        ]
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, particle: str, position: Tuple[float,float], lifespan: int, velocity: Tuple[float,float] = None, colour: Tuple[int,int,int] = None, acceleration: Tuple[float,float] = None, below: bool = False, randomness: Tuple[float,float] = (1.0,1.0), size: int = 8, text: str = "") -> bool:
+        """Add a particle, takes the same arguments as Particle. Returns
+        whether it was added, it won't be if we're full."""
+        if self.count >= self.capacity or particle not in PARTICLE_TYPE_IDS:
+            return False
+        i = self.count
+        self.position[i] = position
+        if velocity is None:
+            # Particles without a velocity stay exactly where they are
+            self.velocity[i] = 0
+            self.acceleration[i] = 0
+            self.randomness[i] = 0
+        else:
+            self.velocity[i] = velocity
+            self.acceleration[i] = acceleration if acceleration is not None else 0
+            self.randomness[i] = randomness
+        self.lifespan[i] = lifespan
+        self.colour[i] = colour if colour is not None else (255, 255, 255)
+        self.type_id[i] = PARTICLE_TYPE_IDS[particle]
+        self.size[i] = size
+        self.below[i] = below
+        self.text[i] = text
+        self.count += 1
+        return True
+
+    def update(self):
+        """Move every particle on by a frame, and remove those that have died."""
+        n = self.count
+        if n == 0:
+            return
+        self.velocity[:n] += self.acceleration[:n]
+        # Jiggle each particle by up to its randomness either way
+        self.position[:n] += self.velocity[:n] + np.random.uniform(-1.0, 1.0, (n, 2)) * self.randomness[:n]
+        self.lifespan[:n] -= 1
+        self.remove(np.flatnonzero(self.lifespan[:n] <= 0))
+
+    def remove(self, rows):
+        """Remove the particles in the given sorted rows."""
+        removed = len(rows)
+        if removed == 0:
+            return
+        count = self.count - removed
+        # Gaps that will be left among the first `count` rows...
+        gaps = rows[rows < count]
+        # ...are filled by the live particles after them
+        dead_after = np.zeros(self.count - count, dtype=bool)
+        dead_after[rows[rows >= count] - count] = True
+        moved = np.flatnonzero(~dead_after) + count
+        for column in self.columns:
+            column[gaps] = column[moved]
+        # Don't hold on to text we'll never draw
+        self.text[count:self.count] = None
+        self.count = count
+
+    def clear(self):
+        self.text[:self.count] = None
+        self.count = 0
+
 
 class ParticleSystem(System):
-    #size is 8 x 8 ONLY
+    """Moves every particle each frame. The RenderSystem draws them."""
     renderSystem = None
-    def __init__(self, renderSystem):
+    def __init__(self, renderSystem, capacity: int = MAX_PARTICLES):
         self.image_cache = {}
         self.renderSystem = renderSystem
+        self.pool = ParticlePool(capacity)
+        # Whether we keep particles at all, e.g. not when nothing draws them
+        self.enabled = True
 
     def update(self, game, dt: float, events: list):
-        for k, v in self.renderSystem.particles.items():
-            kill = []
-            for p in v:
-                if p.doKill:
-                    kill.append(p)
-                else:
-                    p.updatePos()
-            for k in kill:
-                v.remove(k)
-                del(k)
+        self.pool.update()
 
     def add_particle(self, p):
-        if p.particleType in self.renderSystem.particleFunc.keys():
-            (self.renderSystem.particles["below" if p.below else "above"]).append(p)
-        else:
-            del(p)
+        self.spawn(
+            p.particleType,
+            p.position,
+            p.lifespan,
+            velocity = p.velocity,
+            colour = p.colour,
+            acceleration = p.acceleration,
+            below = p.below,
+            randomness = p.randomness,
+            size = p.size,
+            text = p.textValue
+        )
+
+    def spawn(self, particle: str, position: Tuple[float,float], lifespan: int, **kwargs) -> bool:
+        """Add a particle straight to our pool, without making a Particle."""
+        if not self.enabled:
+            return False
+        return self.pool.spawn(particle, position, lifespan, **kwargs)
 
     def add_damage_particle(self, damage, pos, colour = (255,0,0)):
         self.add_particle(
@@ -53,13 +156,14 @@ class ParticleSystem(System):
         
         
 class Particle:
+    """Describes a particle for ParticleSystem.add_particle, which copies it
+    into its pool."""
     velocity: Tuple[float,float]
     acceleration: Tuple[float,float]
     position: Tuple[float,float]
     colour: Tuple[int,int,int]
     particleType: str
     lifespan: int
-    doKill: bool
     below: bool
     randomness: Tuple[float,float]
     size: int
@@ -72,27 +176,10 @@ class Particle:
         self.colour = colour
         self.velocity = velocity
         self.acceleration = acceleration
-        self.doKill = False
         self.below = below
         self.randomness = randomness
         self.size = size
         self.textValue = text
 
-    def updatePos(self):
-        if self.velocity is not None:
-            if self.acceleration is not None:
-                self.velocity = (self.velocity[0] + self.acceleration[0], self.velocity[1] + self.acceleration[1])
-            self.position = (self.position[0] + self.velocity[0] + self.randomModi(0), self.position[1] + self.velocity[1] + self.randomModi(1))
-        self.lifespan -= 1
-        if self.lifespan <= 0:
-            self.kill()
-
-    def kill(self):
-        self.doKill = True
-
-    def randomModi(self, axis):
-        i = random.uniform(-10.0,10)
-        return (i * self.randomness[axis])/10
-
     def get_random_colour():
         return random.choice([(255,0,0),(255,255,0),(0,255,0),(0,255,255),(0,0,255),(255,0,255)])
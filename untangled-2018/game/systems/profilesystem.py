@@ -39,44 +39,43 @@ class ProfileSystem(System):
         self.ourColour = colour
 
     def update(self, game, dt, events):
-        for key, entity in game.entities.items():
-            # Does this entity have a profile we can use to do things?
-            if Profile in entity:
-                if PlayerControl in entity and game.net.is_me(entity[PlayerControl].player_id):
-                    # It's us, update our Profile component based on what we know
-                    if entity[Profile].name != self.ourName:
-                        entity[Profile].name = self.ourName
-                    if entity[Profile].gender != self.ourGender:
-                        entity[Profile].gender = self.ourGender
-                    if entity[Profile].colour != self.ourColour:
-                        if self.ourColour == (-1,-1,-1):
-                            entity[Profile].colour = (00,255,29)
-                        else:
-                            entity[Profile].colour = self.ourColour
-                        if ParticleEmitter in entity:
-                            entity[ParticleEmitter].colour = self.ourColour
+        # Does this entity have a profile we can use to do things?
+        for key, entity in game.query(Profile):
+            if PlayerControl in entity and game.net.is_me(entity[PlayerControl].player_id):
+                # It's us, update our Profile component based on what we know
+                if entity[Profile].name != self.ourName:
+                    entity[Profile].name = self.ourName
+                if entity[Profile].gender != self.ourGender:
+                    entity[Profile].gender = self.ourGender
+                if entity[Profile].colour != self.ourColour:
+                    if self.ourColour == (-1,-1,-1):
+                        entity[Profile].colour = (00,255,29)
+                    else:
+                        entity[Profile].colour = self.ourColour
+                    if ParticleEmitter in entity:
+                        entity[ParticleEmitter].colour = self.ourColour
 
-                if SpriteSheet in entity:
-                    # This entity should change appearance based on gender, let's do that
-                    if entity[Profile].gender in PROFILE_SPRITES:
-                        # Get the appearance properties
-                        gender_sheet = PROFILE_SPRITES[entity[Profile].gender]
-                        changed = False
+            if SpriteSheet in entity:
+                # This entity should change appearance based on gender, let's do that
+                if entity[Profile].gender in PROFILE_SPRITES:
+                    # Get the appearance properties
+                    gender_sheet = PROFILE_SPRITES[entity[Profile].gender]
+                    changed = False
                         
-                        # Do they need updating?
-                        for sheet_key, value in gender_sheet["tiles"].items():
-                            if entity[SpriteSheet].tiles[sheet_key] != value:
-                                changed = True
-                                break
+                    # Do they need updating?
+                    for sheet_key, value in gender_sheet["tiles"].items():
+                        if entity[SpriteSheet].tiles[sheet_key] != value:
+                            changed = True
+                            break
 
-                        # Yes, update them
-                        if changed:
-                            entity[SpriteSheet].path = gender_sheet['path']
-                            entity[SpriteSheet].tile_size = gender_sheet['tile_size']
-                            entity[SpriteSheet].tiles = {
-                                'default' : gender_sheet["tiles"]['default'],
-                                'left' : gender_sheet["tiles"]['left'],
-                                'right' : gender_sheet["tiles"]['right'],
-                                'up' : gender_sheet["tiles"]['up'],
-                                'down' : gender_sheet["tiles"]['down']
-                            }
+                    # Yes, update them
+                    if changed:
+                        entity[SpriteSheet].path = gender_sheet['path']
+                        entity[SpriteSheet].tile_size = gender_sheet['tile_size']
+                        entity[SpriteSheet].tiles = {
+                            'default' : gender_sheet["tiles"]['default'],
+                            'left' : gender_sheet["tiles"]['left'],
+                            'right' : gender_sheet["tiles"]['right'],
+                            'up' : gender_sheet["tiles"]['up'],
+                            'down' : gender_sheet["tiles"]['down']
+                        }
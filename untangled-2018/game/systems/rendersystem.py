@@ -1,10 +1,26 @@
 import math
+from collections import OrderedDict
+import time
+import numpy as np
 import pygame
 from pygame import Rect
 
 from lib.system import System
+from lib.text import text_cache
 from game.components import *
 from game.systems.collisionsystem import *
+from game.systems.particlesystem import PARTICLE_TYPES, PARTICLE_TYPE_IDS
+
+# How many tiles wide and high each pre-drawn piece of the tilemap is
+CHUNK_TILES = 16
+# How many pieces of the tilemap to keep drawn at once
+MAX_CHUNKS = 48
+# How many scaled sprite images to keep at once
+MAX_SCALED_IMAGES = 512
+# How many differently sized and coloured particle shapes to keep drawn
+MAX_PARTICLE_SPRITES = 256
+# How many seconds between updates of the profiler overlay
+PROFILE_REFRESH = 0.5
 
 class RenderSystem(System):
     """This system draws any entity with a SpriteSheet component."""
@@ -13,95 +29,97 @@ class RenderSystem(System):
         self.lightingImg = pygame.Surface(framework.dimensions, pygame.SRCALPHA, 32).convert_alpha()
         self.lightingImg.fill((0,0,0,0))
         self.screen = screen
+        # The tilemap, baked into chunks by (chunk x, chunk y, animation frame)
+        self.chunks = OrderedDict()
+        self.chunk_periods = {}
+        self.chunk_source = None
+        # Covers the tilemap to make it darker at night
+        self.darkness = pygame.Surface(framework.dimensions).convert()
+        self.darkness.fill((0, 0, 0))
+        # What we've drawn over the tilemap this frame and last frame
+        self.dirty = []
+        self.previous_dirty = []
+        # Where we were looking last frame, and whether that's changed
+        self.last_view = None
+        self.moved = True
         self.image_cache = {}
+        # Images we've already scaled, by (path, index, size, flipped)
+        self.scaled_cache = OrderedDict()
+        self.scaled_hits = 0
+        self.scaled_misses = 0
         self.steps = 0
         self.ticks = 0
-        self.particles = {
-            'above':[],
-            'below':[]
-        }
         self.particleFunc = {
-            'square': lambda p, s: self.particle_square(p,s),
-            'circle': lambda p, s: self.particle_circle(p,s),
-            'ring': lambda p, s: self.particle_ring(p,s),
-            'star': lambda p, s: self.particle_star(p,s),
-            'text': lambda p, s: self.particle_text(p,s)
+            'square': self.particle_square,
+            'circle': self.particle_circle,
+            'ring': self.particle_ring,
+            'star': self.particle_star,
         }
+        # Particle shapes we've drawn, by (type id, size, colour)
+        self.particle_sprites = {}
 
         font_path = 'assets/fonts/alterebro-pixel-font.ttf'
         self.font = pygame.font.Font(font_path, 45)
         self.damageFont = pygame.font.Font(font_path, 45)
         self.damageFont.set_bold(True)
+        self.profileFont = pygame.font.Font(font_path, 28)
 
+        # Whether we're showing how long each part of a frame takes
+        self.show_profile = False
+        self.profile_lines = []
+        self.profile_background = None
+        self.profile_updated = 0
 
     def update(self, game, dt: float, events: list):
         # Step through 15 sprite frames each second
         self.steps += dt
         frame = int(self.steps // (1.0 / 15))
+        now = time.time()
+        self.previous_dirty, self.dirty = self.dirty, []
 
         # Find our center, if we have a player to focus on
         our_center = (0, 0)
-        for key, entity in game.entities.items():
-            # Are they a player?
-            if PlayerControl in entity and IngameObject in entity:
-                # Are they us?
-                if game.net.is_me(entity[PlayerControl].player_id):
-                    our_center = entity[IngameObject].position
-                    break
+        for key, entity in game.query(PlayerControl, IngameObject):
+            # Are they us?
+            if game.net.is_me(entity[PlayerControl].player_id):
+                our_center = entity[IngameObject].position
+                break
         
         invMapX = {"min": 0, "max": 0}
         invMapY = {"min": 0, "max": 0}
 
         # Draw tilemap
-        for key, entity in game.entities.items():
-            if Map in entity and SpriteSheet in entity:
-                spritesheet = entity[SpriteSheet]
-                map = entity[Map]
-                # minimum and maximum tile indexes coordinates possible
-                min_x = math.floor((our_center[0] - game.framework.dimensions[0]/2) / spritesheet.tile_size)
-                min_y = math.floor((our_center[1] - game.framework.dimensions[1]/2) / spritesheet.tile_size)
-                max_x = math.floor((our_center[0] + game.framework.dimensions[0]/2) / spritesheet.tile_size)
-                max_y = math.floor((our_center[1] + game.framework.dimensions[1]/2) / spritesheet.tile_size)
-                for y in range(min_y, max_y + 1):
-                    for x in range(min_x, max_x + 1):
-                        if 0 <= x < map.width and 0 <= y < map.height:
-                            tile = map.grid[y][x]
-                        else:
-                            tile = 20
-                        img_indexes = spritesheet.tiles[str(tile-1)]
-                        if spritesheet.moving:
-                            img_index = img_indexes[frame % len(img_indexes)]
-                        else:
-                            img_index = img_indexes[0]
-                        image = self.get_image(spritesheet, img_index)
-                        rel_pos = (
-                            x * spritesheet.tile_size - our_center[0],
-                            y * spritesheet.tile_size - our_center[1]
-                        )
-
-                        screen_pos = (
-                            rel_pos[0] + game.framework.dimensions[0]/2,
-                            rel_pos[1] + game.framework.dimensions[1]/2
-                        )
-                        image = image.convert()
-                        alpha = math.sin(self.ticks/1000)*100
-                        alpha = 100 - alpha
-                        if alpha > 255:
-                            alpha = 255
-                        image.set_alpha(alpha)
-                        self.screen.blit(image, screen_pos)
+        view = [our_center]
+        for key, entity in game.query(Map, SpriteSheet):
+            view.append(self.draw_tilemap(game, entity[Map], entity[SpriteSheet], our_center, frame))
+
+        # Darken the tilemap for the time of day
+        if self.darkness.get_size() != tuple(game.framework.dimensions):
+            # The window's been resized
+            self.darkness = pygame.Surface(game.framework.dimensions).convert()
+            self.darkness.fill((0, 0, 0))
+        alpha = math.sin(self.ticks/1000)*100
+        alpha = 100 - alpha
+        if alpha > 255:
+            alpha = 255
+        self.darkness.set_alpha(255 - int(alpha))
+        self.screen.blit(self.darkness, (0, 0))
+        view.append(255 - int(alpha))
+
+        # If the tilemap looks different, the whole screen has changed
+        view = tuple(view)
+        self.moved = view != self.last_view
+        self.last_view = view
 
         self.draw_particles(game, "below", our_center)
 
         #pygame.draw.rect(self.screen,(255,0,0),Rect(0,0,self.screen.get_width(), self.screen.get_height()))
 
-        previousCollidables = []
-
         # Render everything we can
-        for key, entity in game.entities.items():
+        for key, entity in game.query(IngameObject):
             r = False
             
-            # Don't check for items being picked up
+            # Don't draw items being picked up
             if CanPickUp in entity:
                 if entity[CanPickUp].pickedUp:  
                     continue
@@ -111,15 +129,13 @@ class RenderSystem(System):
                             entity[GameAction].action = "delete"
                             continue
 
-            #Check collisions for entity against all previously checked entities
-            if IngameObject in entity and Collidable in entity:
-                if entity[Collidable].canCollide:
-                    game.collisionSystem.checkCollisions(game,key,entity[Collidable],previousCollidables)
-                    previousCollidables.append((key,entity[Collidable]))
+            if Wieldable in entity and entity[Wieldable].player_id not in game.entities:
+                # We can't see who's holding it, so we don't know where it is
+                continue
 
-            if IngameObject in entity and Wieldable not in entity:
+            if Wieldable not in entity:
                 # Where are they relative to us?
-                pos = entity[IngameObject].position
+                pos = self.get_drawn_position(entity, now)
                 rel_pos = (pos[0] - our_center[0], pos[1] - our_center[1])
                 screen_pos = (
                     rel_pos[0] + game.framework.dimensions[0]/2,
@@ -128,18 +144,16 @@ class RenderSystem(System):
                 if screen_pos[0] < 0 or screen_pos[0] > self.screen.get_width() or screen_pos[1] < 0 or screen_pos[1] > self.screen.get_height():
                     continue
 
-            if IngameObject in entity and ParticleEmitter in entity:
+            if ParticleEmitter in entity:
                 if entity[ParticleEmitter].colour == (-1,-1,-1):
                     r = True
-                new_particles = entity[ParticleEmitter].getParticles(entity)
-                for new_part in new_particles:
-                    game.particles.add_particle(new_part)
+                entity[ParticleEmitter].getParticles(entity, game.particles)
 
             # Is this an entity we should draw?
-            if IngameObject in entity and SpriteSheet in entity:
+            if SpriteSheet in entity:
                 
                 # Where are they relative to us?
-                pos = entity[IngameObject].position
+                pos = self.get_drawn_position(entity, now)
                 rel_pos = (pos[0] - our_center[0], pos[1] - our_center[1])
                 screen_pos = (
                     rel_pos[0] + game.framework.dimensions[0]/2,
@@ -184,29 +198,26 @@ class RenderSystem(System):
                     img_index = img_indexes[frame % len(img_indexes)]
                 else:
                     img_index = img_indexes[spritesheet.default_tile]
-                img = self.get_image(spritesheet, img_index)
-
-                #Scale the image
-                if img.get_size() != entity[IngameObject].size:
-                    img = pygame.transform.scale(img, entity[IngameObject].size)
+                # Get the image, scaled to the size we draw it
+                img = self.get_image(spritesheet, img_index, entity[IngameObject].size)
                 
                 rect = Rect(screen_pos, entity[IngameObject].size)
                 rect.center = screen_pos
                 
                 # Add a rectangle behind the item because the quantity is seen outside of the item
                 if CanPickUp in entity:
-                    pygame.draw.circle(self.screen, (0, 255, 0), (int(rect.x + rect.width / 2), int(rect.y + rect.height / 2)), int(rect.width/2))
+                    self.mark(pygame.draw.circle(self.screen, (0, 255, 0), (int(rect.x + rect.width / 2), int(rect.y + rect.height / 2)), int(rect.width/2)))
 
                 # Draw the image, but only if it's on screen
                 if not (rect.right < 0 or rect.left >= game.framework.dimensions[0] or rect.bottom < 0 or rect.top >= game.framework.dimensions[1]):
-                    self.screen.blit(img, rect)
+                    self.blit(img, rect)
 
                 # If it is an item show the amount of items there are
                 if CanPickUp in entity:
                     if entity[CanPickUp].quantity > 1:
-                        rendered_text_qitem = self.font.render(str(entity[CanPickUp].quantity), False, (0, 0, 0))
+                        rendered_text_qitem = text_cache.render(self.font, str(entity[CanPickUp].quantity), (0, 0, 0))
                         
-                        self.screen.blit(rendered_text_qitem, rect)
+                        self.blit(rendered_text_qitem, rect)
                         
                 # Center health bar and nametag
                 rect.x -= 30
@@ -214,35 +225,35 @@ class RenderSystem(System):
                 if Energy in entity:
                     # Energy bar wrapper
                     energyBarThickness = 2
-                    pygame.draw.rect(self.screen, (255, 255, 255),(rect.x, rect.y-45, 100+energyBarThickness*2, 10), energyBarThickness)
+                    self.mark(pygame.draw.rect(self.screen, (255, 255, 255),(rect.x, rect.y-45, 100+energyBarThickness*2, 10), energyBarThickness))
                     
                     # Yellow energy bar
                     if entity[Energy].value > 0:
                         currentEnergyPos = (rect.x+energyBarThickness, rect.y-45+energyBarThickness, entity[Energy].value, 10-energyBarThickness*2)
-                        pygame.draw.rect(self.screen, (255, 255, 0), currentEnergyPos)
+                        self.mark(pygame.draw.rect(self.screen, (255, 255, 0), currentEnergyPos))
 
                 # Checks if entity has a health component
                 if Health in entity:
                     # Health bar wrapper
                     healthBarThickness = 2
-                    pygame.draw.rect(self.screen, (255, 255, 255), (rect.x, rect.y-30, 100+healthBarThickness*2, 10), healthBarThickness)
+                    self.mark(pygame.draw.rect(self.screen, (255, 255, 255), (rect.x, rect.y-30, 100+healthBarThickness*2, 10), healthBarThickness))
              
                     # Red health bar
                     if entity[Health].value > 0:
                         healthValue = int(entity[Health].value / entity[Health].maxValue * 100)
                         currentHealthPos = (rect.x+healthBarThickness, rect.y-30+healthBarThickness, healthValue, 10-healthBarThickness*2)
-                        pygame.draw.rect(self.screen, (255, 0, 0), currentHealthPos)
+                        self.mark(pygame.draw.rect(self.screen, (255, 0, 0), currentHealthPos))
 
                 if WaterBar in entity:
                     if not entity[WaterBar].disabled:
                         # Water bar wrapper
                         waterBarThickness = 2
-                        pygame.draw.rect(self.screen, (255, 255, 255), (rect.x, rect.y-60, 100+waterBarThickness*2, 10), waterBarThickness)
+                        self.mark(pygame.draw.rect(self.screen, (255, 255, 255), (rect.x, rect.y-60, 100+waterBarThickness*2, 10), waterBarThickness))
 
                         # Blue water bar
                         if entity[Health].value > 0:
                             currentWaterPos = (rect.x+waterBarThickness, rect.y-60+waterBarThickness, entity[WaterBar].value, 10-waterBarThickness*2)
-                            pygame.draw.rect(self.screen, (0, 0, 255), currentWaterPos)
+                            self.mark(pygame.draw.rect(self.screen, (0, 0, 255), currentWaterPos))
 
                         rect.y -= 15
 
@@ -251,13 +262,13 @@ class RenderSystem(System):
                     name = entity[Profile].name
 
                     # Draw our name with our font in white
-                    rendered_text_surface = self.font.render(name, False, entity[Profile].colour if not r else Particle.get_random_colour())
+                    rendered_text_surface = text_cache.render(self.font, name, entity[Profile].colour if not r else Particle.get_random_colour())
 
                     # Move the nametag above the player
                     rect.y -= 100
 
                     # Draw this rendered text we've made to the screen
-                    self.screen.blit(rendered_text_surface, rect)
+                    self.blit(rendered_text_surface, rect)
 
                 # Checks if it is a player
                 if PlayerControl in entity:
@@ -279,7 +290,7 @@ class RenderSystem(System):
 
                             # Draw inventory bar
                             inventoryPos = (inv.x, inv.y, inv.width, inv.height)
-                            pygame.draw.rect(self.screen, inventoryBackgroundColour, inventoryPos)
+                            self.mark(pygame.draw.rect(self.screen, inventoryBackgroundColour, inventoryPos))
                             invX = game.screen.get_width() / 2 - inv.width / 2
                             invY = game.screen.get_height() - inv.height - inv.slotOffset
 
@@ -297,7 +308,7 @@ class RenderSystem(System):
                                 else:
                                     colour = slotBackgroundColour
 
-                                pygame.draw.rect(self.screen, colour, (x, invY+inv.slotOffset, inv.slotSize, inv.slotSize))
+                                self.mark(pygame.draw.rect(self.screen, colour, (x, invY+inv.slotOffset, inv.slotSize, inv.slotSize)))
 
                                 slotIndex += 1
                             
@@ -308,58 +319,204 @@ class RenderSystem(System):
                                     itemImgIndex = itemImgIndexes[frame % len(itemImgIndexes)]
 
                                     # If it does, get its image
-                                    itemImg = self.get_image(data['sprite'], itemImgIndex)
                                     itemW, itemH = (inv.slotSize-inv.slotOffset, inv.slotSize-inv.itemSlotOffset * 2)
-                                    itemImg = pygame.transform.scale(itemImg, (itemW, itemH))
+                                    itemImg = self.get_image(data['sprite'], itemImgIndex, (itemW, itemH))
 
                                     # The item is placed in the slot with a 3px offset
                                     itemRect = (invX + (distanceBetweenSlots * slotIndex) + inv.itemSlotOffset, invY+inv.slotOffset + inv.itemSlotOffset, itemW, itemH)
-                                    self.screen.blit(itemImg, itemRect)
+                                    self.blit(itemImg, itemRect)
 
                                     # Drawing text that shows how many items of this kind there are
                                     lItemRect = list(itemRect)
                                     lItemRect[1] += inv.slotOffset
                                     itemRect = tuple(lItemRect)
 
-                                    rendered_text_qslot = self.font.render(str(data['quantity']), False, (0, 0, 128))
-                                    self.screen.blit(rendered_text_qslot, itemRect)
+                                    rendered_text_qslot = text_cache.render(self.font, str(data['quantity']), (0, 0, 128))
+                                    self.blit(rendered_text_qslot, itemRect)
 
                                 slotIndex += 1
-            if Clock in entity:
-                time_names = ("Dusk","Dawn","Morning","Noon","Afternoon","Evening")
-                rendered_text_surface = self.font.render(time_names[entity[Clock].minute], False, (255, 255, 255))
-                rect = rendered_text_surface.get_rect()
-                rect.topleft = (10,5) 
-                self.screen.blit(rendered_text_surface, rect)
+
+        # Draw the time of day
+        for key, entity in game.query(Clock, Timed):
+            time_names = ("Dusk","Dawn","Morning","Noon","Afternoon","Evening")
+            rendered_text_surface = text_cache.render(self.font, time_names[entity[Clock].minute], (255, 255, 255))
+            rect = rendered_text_surface.get_rect()
+            rect.topleft = (10,5) 
+            self.blit(rendered_text_surface, rect)
                 
-                cycle= entity[Clock].cycle
-                rendered_text_surface = self.font.render(str("Day"), False, (255, 255, 255))
-                rect = rendered_text_surface.get_rect()
-                rect.topleft= (150,5) 
-                self.screen.blit(rendered_text_surface, rect)
+            cycle= entity[Clock].cycle
+            rendered_text_surface = text_cache.render(self.font, str("Day"), (255, 255, 255))
+            rect = rendered_text_surface.get_rect()
+            rect.topleft= (150,5) 
+            self.blit(rendered_text_surface, rect)
             
-                cycle= entity[Clock].cycle
-                rendered_text_surface = self.font.render(str(cycle), False, (255, 255, 255))
-                rect = rendered_text_surface.get_rect()
-                rect.topleft= (215,5) 
-                self.screen.blit(rendered_text_surface, rect)
-
-                year= entity[Clock].year
-                rendered_text_surface = self.font.render(str("Year"), False, (255, 255, 255))
-                rect = rendered_text_surface.get_rect()
-                rect.topleft= (270,5) 
-                self.screen.blit(rendered_text_surface, rect)
+            cycle= entity[Clock].cycle
+            rendered_text_surface = text_cache.render(self.font, str(cycle), (255, 255, 255))
+            rect = rendered_text_surface.get_rect()
+            rect.topleft= (215,5) 
+            self.blit(rendered_text_surface, rect)
+
+            year= entity[Clock].year
+            rendered_text_surface = text_cache.render(self.font, str("Year"), (255, 255, 255))
+            rect = rendered_text_surface.get_rect()
+            rect.topleft= (270,5) 
+            self.blit(rendered_text_surface, rect)
             
-                year= entity[Clock].year
-                rendered_text_surface = self.font.render(str(year), False, (255, 255, 255))
-                rect = rendered_text_surface.get_rect()
-                rect.topleft= (340,5) 
-                self.screen.blit(rendered_text_surface, rect)
+            year= entity[Clock].year
+            rendered_text_surface = text_cache.render(self.font, str(year), (255, 255, 255))
+            rect = rendered_text_surface.get_rect()
+            rect.topleft= (340,5) 
+            self.blit(rendered_text_surface, rect)
+
+            self.ticks = entity[Timed].time + (entity[Clock].minute * 3600) + (entity[Clock].cycle * 21600) + (entity[Clock].year * 7776000)
 
-                self.ticks = entity[Timed].time + (entity[Clock].minute * 3600) + (entity[Clock].cycle * 21600) + (entity[Clock].year * 7776000)
         self.draw_particles(game, "above", our_center)
 
-    def get_image(self, spritesheet, index):
+        for event in events:
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.show_profile = not self.show_profile
+        if self.show_profile:
+            self.draw_profile(game, now)
+
+    def draw_profile(self, game, now):
+        """Draw how long each part of recent frames took, and how much of everything there is."""
+        profiler = game.framework.profiler
+        line_height = self.profileFont.get_linesize()
+        # The numbers change every frame, only keep up twice a second so we can read them
+        if now - self.profile_updated > PROFILE_REFRESH:
+            self.profile_updated = now
+            self.profile_lines = ['ms: p50 / p95 / p99']
+            stats = profiler.get_stats()
+            for name in sorted(stats, key=lambda name: stats[name]['p95'], reverse=True):
+                row = stats[name]
+                self.profile_lines.append('{}: {:.2f} / {:.2f} / {:.2f}'.format(name, row['p50'], row['p95'], row['p99']))
+            for name, value in profiler.counts.items():
+                self.profile_lines.append('{}: {}'.format(name, value))
+            self.profile_background = pygame.Surface((360, line_height * len(self.profile_lines) + 10), pygame.SRCALPHA, 32)
+            self.profile_background.fill((0, 0, 0, 160))
+
+        self.blit(self.profile_background, (10, 60))
+        for i, line in enumerate(self.profile_lines):
+            self.blit(text_cache.render(self.profileFont, line, (255, 255, 255)), (15, 65 + i * line_height))
+
+    def blit(self, surface, pos):
+        self.mark(self.screen.blit(surface, pos))
+
+    def mark(self, rect):
+        # Remember we've drawn over part of the screen
+        self.dirty.append(rect)
+
+    def get_dirty_rects(self):
+        """The parts of the screen that have changed since last frame: where
+        we've drawn this frame and where we drew last frame. None if the whole
+        screen has changed, e.g. if we've scrolled."""
+        if self.moved:
+            return None
+        return self.previous_dirty + self.dirty
+
+    def draw_tilemap(self, game, map, spritesheet, our_center, frame):
+        """Draw the part of the map we can see. Returns which animation frame
+        each chunk on screen was drawn at."""
+        if self.chunk_source != (map, spritesheet):
+            # A different map, nothing we've baked is any use
+            self.chunks.clear()
+            self.chunk_periods.clear()
+            self.chunk_source = (map, spritesheet)
+
+        chunk_size = CHUNK_TILES * spritesheet.tile_size
+        # minimum and maximum chunk coordinates on screen
+        min_x = math.floor((our_center[0] - game.framework.dimensions[0]/2) / chunk_size)
+        min_y = math.floor((our_center[1] - game.framework.dimensions[1]/2) / chunk_size)
+        max_x = math.floor((our_center[0] + game.framework.dimensions[0]/2) / chunk_size)
+        max_y = math.floor((our_center[1] + game.framework.dimensions[1]/2) / chunk_size)
+        variants = []
+        for y in range(min_y, max_y + 1):
+            for x in range(min_x, max_x + 1):
+                variant = self.get_chunk_variant(map, spritesheet, x, y, frame)
+                variants.append(variant)
+                chunk = self.get_chunk(map, spritesheet, x, y, variant)
+                screen_pos = (
+                    x * chunk_size - our_center[0] + game.framework.dimensions[0]/2,
+                    y * chunk_size - our_center[1] + game.framework.dimensions[1]/2
+                )
+                self.screen.blit(chunk, screen_pos)
+        return tuple(variants)
+
+    def get_tile_images(self, map, spritesheet, x, y):
+        # Every image a tile animates through
+        if 0 <= x < map.width and 0 <= y < map.height:
+            tile = map.grid[y][x]
+        else:
+            tile = 20
+        return spritesheet.tiles[str(tile-1)]
+
+    def get_chunk_variant(self, map, spritesheet, chunk_x, chunk_y, frame):
+        # Which of a chunk's animation frames we're on
+        position = (chunk_x, chunk_y)
+        if position not in self.chunk_periods:
+            # How many frames until every tile in the chunk is back where it started
+            period = 1
+            for y in range(chunk_y * CHUNK_TILES, (chunk_y + 1) * CHUNK_TILES):
+                for x in range(chunk_x * CHUNK_TILES, (chunk_x + 1) * CHUNK_TILES):
+                    length = len(self.get_tile_images(map, spritesheet, x, y))
+                    period = period * length // math.gcd(period, length)
+            self.chunk_periods[position] = period
+        return frame % self.chunk_periods[position] if spritesheet.moving else 0
+
+    def get_chunk(self, map, spritesheet, chunk_x, chunk_y, variant):
+        """Get a CHUNK_TILES square of the tilemap as one image, at one of its animation frames."""
+        chunk_key = (chunk_x, chunk_y, variant)
+        if chunk_key in self.chunks:
+            self.chunks.move_to_end(chunk_key)
+            return self.chunks[chunk_key]
+
+        chunk_size = CHUNK_TILES * spritesheet.tile_size
+        chunk = pygame.Surface((chunk_size, chunk_size)).convert()
+        for y in range(CHUNK_TILES):
+            for x in range(CHUNK_TILES):
+                img_indexes = self.get_tile_images(map, spritesheet, chunk_x * CHUNK_TILES + x, chunk_y * CHUNK_TILES + y)
+                img_index = img_indexes[variant % len(img_indexes)]
+                image = self.get_image(spritesheet, img_index)
+                chunk.blit(image, (x * spritesheet.tile_size, y * spritesheet.tile_size))
+
+        self.chunks[chunk_key] = chunk
+        if len(self.chunks) > MAX_CHUNKS:
+            # Forget whichever we've gone longest without drawing
+            self.chunks.popitem(last=False)
+        return chunk
+
+    def get_drawn_position(self, entity, now):
+        # Slide between network snapshots, unless we've moved it ourselves since
+        if Interpolated in entity and entity[Interpolated].target == entity[IngameObject].position:
+            return entity[Interpolated].get_position(now)
+        return entity[IngameObject].position
+
+    def get_image(self, spritesheet, index, size=None, flip=False):
+        """Get one image from a spritesheet, optionally scaled to a size and
+        flipped left to right. Scaled images are cached too."""
+        if size is None and not flip:
+            return self.get_sheet_image(spritesheet, index)
+
+        image_key = (spritesheet.path, index, tuple(size) if size is not None else None, flip)
+        if image_key in self.scaled_cache:
+            self.scaled_hits += 1
+            self.scaled_cache.move_to_end(image_key)
+            return self.scaled_cache[image_key]
+
+        self.scaled_misses += 1
+        img = self.get_sheet_image(spritesheet, index)
+        if size is not None and img.get_size() != tuple(size):
+            img = pygame.transform.scale(img, size)
+        if flip:
+            img = pygame.transform.flip(img, True, False)
+
+        self.scaled_cache[image_key] = img
+        if len(self.scaled_cache) > MAX_SCALED_IMAGES:
+            # Forget whichever we've gone longest without drawing
+            self.scaled_cache.popitem(last=False)
+        return img
+
+    def get_sheet_image(self, spritesheet, index):
         # Ideally, we cache so we only process a file once
         if spritesheet.path not in self.image_cache:
             # Load from file
@@ -389,42 +546,91 @@ class RenderSystem(System):
         return self.image_cache[spritesheet.path][index]
 
     def draw_particles(self, game, height: str, our_center):
-        if height in self.particles.keys():
-            for p in self.particles[height]:
-                self.draw_particle(game, p, our_center)
-
-    def draw_particle(self, game, particle, our_center):
-        pos = (particle.position[0], particle.position[1])
-        rel_pos = (pos[0] - our_center[0], pos[1] - our_center[1])
-        screen_pos = (round(rel_pos[0] + game.framework.dimensions[0] / 2), round(rel_pos[1] + game.framework.dimensions[1] / 2))
-        if screen_pos[0] < 0 or screen_pos[0] > self.screen.get_width() or screen_pos[1] < 0 or screen_pos[1] > self.screen.get_height():
-            particle.doKill = True
+        pool = game.particles.pool
+        n = pool.count
+        if n == 0:
             return
-        self.particleFunc[particle.particleType](particle, screen_pos)
-
-    def particle_square(self, p, pos):
-        rect = Rect(pos[0],pos[1],p.size,p.size)
-        pygame.draw.rect(self.screen,p.colour,rect)
 
-    def particle_circle(self, p, pos):
-        pygame.draw.circle(self.screen,p.colour,pos,int(round(p.size/2)))
+        # Where every particle is on the screen, all worked out at once
+        offset = (game.framework.dimensions[0] / 2 - our_center[0], game.framework.dimensions[1] / 2 - our_center[1])
+        screen_pos = np.rint(pool.position[:n] + offset).astype(int)
+        in_layer = pool.below[:n] == (height == "below")
+        on_screen = (
+            (screen_pos[:, 0] >= 0) & (screen_pos[:, 0] <= self.screen.get_width()) &
+            (screen_pos[:, 1] >= 0) & (screen_pos[:, 1] <= self.screen.get_height())
+        )
+        visible = np.flatnonzero(in_layer & on_screen)
+        is_text = pool.type_id[visible] == PARTICLE_TYPE_IDS['text']
+
+        # Shapes are drawn from pre-drawn sprites, all in one go
+        shapes = visible[~is_text]
+        if len(shapes) > 0:
+            # Find each different kind of sprite we need, and which each particle uses
+            colour = pool.colour[shapes].astype(np.int64)
+            kinds = (
+                (pool.type_id[shapes].astype(np.int64) << 48) | (pool.size[shapes].astype(np.int64) << 24) |
+                (colour[:, 0] << 16) | (colour[:, 1] << 8) | colour[:, 2]
+            )
+            kinds, first, inverse = np.unique(kinds, return_index=True, return_inverse=True)
+            sprites = np.empty(len(kinds), dtype=object)
+            sprite_offsets = np.zeros((len(kinds), 2), dtype=int)
+            for kind, row in enumerate(shapes[first]):
+                sprites[kind], sprite_offsets[kind] = self.get_particle_sprite(
+                    int(pool.type_id[row]), int(pool.size[row]), tuple(pool.colour[row].tolist())
+                )
+            positions = screen_pos[shapes] + sprite_offsets[inverse]
+            self.dirty.extend(self.screen.blits(list(zip(sprites[inverse].tolist(), positions.tolist()))))
+
+        # Text is different every time, so it's drawn on its own
+        for row in visible[is_text]:
+            self.particle_text(pool.text[row], tuple(pool.colour[row].tolist()), tuple(screen_pos[row].tolist()))
+
+        # Particles that leave the screen are gone for good
+        pool.remove(np.flatnonzero(in_layer & ~on_screen))
+
+    def get_particle_sprite(self, type_id, size, colour):
+        """Get a particle's shape drawn on its own surface, and where to draw
+        that surface relative to the particle's position."""
+        sprite_key = (type_id, size, colour)
+        if sprite_key not in self.particle_sprites:
+            if len(self.particle_sprites) >= MAX_PARTICLE_SPRITES:
+                self.particle_sprites.clear()
+            if PARTICLE_TYPES[type_id] == 'square':
+                # Squares hang down and right from the particle's position
+                middle = 0
+                sprite = pygame.Surface((size, size), pygame.SRCALPHA, 32).convert_alpha()
+            else:
+                # Big enough for the shape, with the particle's position in the middle
+                middle = size // 2 + 2
+                sprite = pygame.Surface((middle * 2 + 1, middle * 2 + 1), pygame.SRCALPHA, 32).convert_alpha()
+            sprite.fill((0, 0, 0, 0))
+            self.particleFunc[PARTICLE_TYPES[type_id]](sprite, size, colour, (middle, middle))
+            self.particle_sprites[sprite_key] = (sprite, (-middle, -middle))
+        return self.particle_sprites[sprite_key]
+
+    def particle_square(self, surface, size, colour, pos):
+        rect = Rect(pos[0],pos[1],size,size)
+        pygame.draw.rect(surface,colour,rect)
+
+    def particle_circle(self, surface, size, colour, pos):
+        pygame.draw.circle(surface,colour,pos,int(round(size/2)))
         
-    def particle_ring(self, p, pos):
-        pygame.draw.circle(self.screen,p.colour,pos,int(round(p.size/2)), int(math.ceil(p.size ** (1/3))))
+    def particle_ring(self, surface, size, colour, pos):
+        pygame.draw.circle(surface,colour,pos,int(round(size/2)), int(math.ceil(size ** (1/3))))
 
-    def particle_star(self, p, pos):
+    def particle_star(self, surface, size, colour, pos):
         hor = (
-            [pos[0] - (p.size/2), pos[1]],
-            [pos[0] + (p.size/2), pos[1]]
+            [pos[0] - (size/2), pos[1]],
+            [pos[0] + (size/2), pos[1]]
         )
         ver = (
-            [pos[0], pos[1] - (p.size/2)],
-            [pos[0], pos[1] + (p.size/2)]
+            [pos[0], pos[1] - (size/2)],
+            [pos[0], pos[1] + (size/2)]
         )
-        pygame.draw.line(self.screen,p.colour,hor[0],hor[1],2)
-        pygame.draw.line(self.screen,p.colour,ver[0],ver[1],2)
+        pygame.draw.line(surface,colour,hor[0],hor[1],2)
+        pygame.draw.line(surface,colour,ver[0],ver[1],2)
 
-    def particle_text(self, p, pos):
-        text_surface = self.damageFont.render(p.textValue,False,p.colour)
-        self.screen.blit(text_surface,pos)
+    def particle_text(self, text, colour, pos):
+        text_surface = text_cache.render(self.damageFont, text, colour)
+        self.blit(text_surface,pos)
 
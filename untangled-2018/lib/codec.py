@@ -0,0 +1,233 @@
+import dataclasses
+import struct
+import typing
+
+from lib.component import registry
+
+# Before each packed component: the entity's handle, the component's type_id
+# and which of its fields follow, one bit each
+HEADER_FORMAT = 'IHI'
+HEADER = struct.Struct('<' + HEADER_FORMAT)
+# How big a buffer we start packing snapshots into
+BUFFER_SIZE = 64 * 1024
+
+# How we pack each type of value a field can hold
+FORMATS = {
+    int: 'q',
+    float: 'd',
+    bool: '?',
+    str: 'H',
+}
+
+
+def get_kinds(annotation):
+    """The formats a field of this type packs into, or None if we can't pack it.
+    Strings pack as their length, with the text after everything else."""
+    if annotation in FORMATS:
+        return (FORMATS[annotation],)
+    if typing.get_origin(annotation) is tuple:
+        args = typing.get_args(annotation)
+        if args and all(arg in (int, float, bool) for arg in args):
+            return tuple(FORMATS[arg] for arg in args)
+    return None
+
+
+class Layout:
+    """How to pack and unpack one set of a component's fields.
+
+    The packing and unpacking is written out as Python for just these
+    fields and compiled, so there's no looping over fields at runtime."""
+
+    def __init__(self, type_id, mask, fields):
+        self.mask = mask
+        formats = ''.join(''.join(kinds) for name, kinds in fields)
+        packer = struct.Struct('<' + HEADER_FORMAT + formats)
+        unpacker = struct.Struct('<' + formats)
+
+        scope = {
+            'pack_into': packer.pack_into,
+            'unpack_from': unpacker.unpack_from,
+            'HEAD_SIZE': packer.size,
+            'BODY_SIZE': unpacker.size,
+            'TYPE_ID': type_id,
+            'MASK': mask,
+            'bool': bool,
+        }
+        exec(self.write_encode('encode_values', fields, 'source[{!r}]'), scope)
+        exec(self.write_encode('encode_component', fields, 'source.{}'), scope)
+        exec(self.write_decode(fields), scope)
+        self.encode_values = scope['encode_values']
+        self.encode_component = scope['encode_component']
+        self.decode = scope['decode']
+
+    def write_encode(self, function, fields, getter):
+        """Source for function(source, buffer, offset, handle), which packs
+        the fields from source at offset and returns where it got to, or None
+        if it needs a bigger buffer."""
+        lines = ['def {}(source, buffer, offset, handle):'.format(function)]
+        args = ['handle', 'TYPE_ID', 'MASK']
+        texts = []
+        for i, (name, kinds) in enumerate(fields):
+            value = 'v{}'.format(i)
+            lines.append('    {} = {}'.format(value, getter.format(name)))
+            if kinds == ('H',):
+                lines.append('    t{} = {}.encode("utf-8")'.format(i, value))
+                args.append('len(t{})'.format(i))
+                texts.append('t{}'.format(i))
+            elif kinds == ('?',):
+                lines.append('    if {}.__class__ is not bool: raise TypeError'.format(value))
+                args.append(value)
+            elif len(kinds) == 1:
+                args.append(value)
+            else:
+                lines.append('    if len({}) != {}: raise TypeError'.format(value, len(kinds)))
+                args.extend('{}[{}]'.format(value, j) for j in range(len(kinds)))
+        lines.append('    end = offset + HEAD_SIZE' + ''.join(' + len({})'.format(text) for text in texts))
+        lines.append('    if end > len(buffer): return None')
+        lines.append('    pack_into(buffer, offset, {})'.format(', '.join(args)))
+        lines.append('    offset += HEAD_SIZE')
+        for text in texts:
+            lines.append('    buffer[offset:offset + len({0})] = {0}'.format(text))
+            lines.append('    offset += len({})'.format(text))
+        lines.append('    return end')
+        return '\n'.join(lines)
+
+    def write_decode(self, fields):
+        """Source for decode(view, offset), which unpacks the fields from a
+        memoryview and returns them and where they end."""
+        lines = [
+            'def decode(view, offset):',
+            '    f = unpack_from(view, offset)',
+            '    offset += BODY_SIZE',
+        ]
+        values = []
+        i = 0
+        for name, kinds in fields:
+            if kinds == ('H',):
+                lines.append('    s{0} = str(view[offset:offset + f[{1}]], "utf-8")'.format(len(values), i))
+                lines.append('    offset += f[{}]'.format(i))
+                values.append('{!r}: s{}'.format(name, len(values)))
+            elif len(kinds) == 1:
+                values.append('{!r}: f[{}]'.format(name, i))
+            else:
+                values.append('{!r}: f[{}:{}]'.format(name, i, i + len(kinds)))
+            i += len(kinds)
+        lines.append('    return {{{}}}, offset'.format(', '.join(values)))
+        return '\n'.join(lines)
+
+
+class ComponentCodec:
+    """Packs a component's fields with struct, working out how from the
+    types the fields are declared with.
+
+    Fields we don't know how to pack (lists, dicts, Unions...) and values
+    that aren't what their field says they are can't be packed, and
+    PackedWriter.add turns them down, so they can be sent some other way."""
+
+    def __init__(self, clas):
+        self.type_id = clas.type_id
+        # (name, formats) of every field, in order
+        self.fields = [(field.name, get_kinds(field.type)) for field in dataclasses.fields(clas)]
+        self.bits = {name: 1 << i for i, (name, kinds) in enumerate(self.fields) if kinds is not None}
+        if len(self.fields) > 32:
+            # Too many to say which are there in the header
+            self.bits = {}
+        # mask of which fields -> Layout
+        self.layouts = {}
+        # the names of some fields, in order -> their Layout, or None if they can't be packed
+        self.by_names = {}
+        # Every field, if we can pack all of them
+        self.everything = None
+        if len(self.bits) == len(self.fields):
+            self.everything = self.get_layout(tuple(name for name, kinds in self.fields))
+
+    def get_layout(self, names):
+        """The Layout for some fields, or None if we can't pack them all."""
+        try:
+            return self.by_names[names]
+        except KeyError:
+            pass
+        mask = 0
+        for name in names:
+            if name not in self.bits:
+                self.by_names[names] = None
+                return None
+            mask |= self.bits[name]
+        layout = self.layouts.get(mask)
+        if layout is None:
+            layout = Layout(self.type_id, mask, [(name, kinds) for name, kinds in self.fields if mask & self.bits.get(name, 0)])
+            self.layouts[mask] = layout
+        self.by_names[names] = layout
+        return layout
+
+    def decode(self, view, offset, mask):
+        """Unpack the fields in mask from a memoryview, returning them and where they end."""
+        layout = self.layouts.get(mask)
+        if layout is None:
+            layout = self.get_layout(tuple(name for name, bit in self.bits.items() if mask & bit))
+        return layout.decode(view, offset)
+
+
+# type_id -> ComponentCodec
+codecs = {}
+
+def get_codec(type_id):
+    codec = codecs.get(type_id)
+    if codec is None:
+        codec = codecs[type_id] = ComponentCodec(registry[type_id])
+    return codec
+
+
+class PackedWriter:
+    """Packs components one after another into a buffer we keep between
+    snapshots, so we're not making a new one each time."""
+
+    def __init__(self, size: int = BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.offset = 0
+
+    def clear(self):
+        self.offset = 0
+
+    def add(self, handle: int, component, values=None) -> bool:
+        """Pack a component, or just the values given of it. Returns False,
+        having packed nothing, if it can't be packed."""
+        codec = codecs.get(component.type_id) or get_codec(component.type_id)
+        if values is None:
+            layout = codec.everything
+            if layout is None:
+                return False
+            encode = layout.encode_component
+            source = component
+        else:
+            layout = codec.get_layout(tuple(values))
+            if layout is None:
+                return False
+            encode = layout.encode_values
+            source = values
+        try:
+            end = encode(source, self.buffer, self.offset, handle)
+            while end is None:
+                self.buffer.extend(bytes(len(self.buffer)))
+                end = encode(source, self.buffer, self.offset, handle)
+        except (struct.error, AttributeError, TypeError):
+            # Not what the field said it'd be
+            return False
+        self.offset = end
+        return True
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buffer[:self.offset])
+
+
+def read_packed(data):
+    """Every (handle, type_id, fields) packed by a PackedWriter."""
+    view = memoryview(data)
+    offset = 0
+    unpack_header = HEADER.unpack_from
+    header_size = HEADER.size
+    while offset < len(view):
+        handle, type_id, mask = unpack_header(view, offset)
+        codec = codecs.get(type_id) or get_codec(type_id)
+        fields, offset = codec.decode(view, offset + header_size, mask)
+        yield handle, type_id, fields
@@ -1,5 +1,10 @@
 from dataclasses import dataclass
 import dataclasses
+import hashlib
+
+# Every component class in the order they were made. A component's type_id
+# is where it is in here, so we can send that instead of its name
+registry = []
 
 def component(networked: bool = False):
     """Is wrapped around a component.
@@ -7,20 +12,29 @@ def component(networked: bool = False):
     Let's us:
     - See changes
     - Auto-create an __init__ function and other niceties
-    - Keep track of whether any properties have been changed"""
+    - Keep track of which properties have been changed"""
 
     # TODO can we do this with a class instead of a decorator?
 
     # We call our decoraters, so we must return an actual decorator function
     def componentWrapper(clas):
         # Dirty hack. Extend the given class with @dataclass to do some dirty work.
-        class Component(dataclass(clas)):
-            _changed=True
+        base = dataclass(clas)
+        field_names = frozenset(field.name for field in dataclasses.fields(base))
+
+        class Component(base):
+            type_id = len(registry)
+            type_name = clas.__name__
 
             def __setattr__(self, name, value):
-                # A property may have been changed! Store this.
-                if name != '_changed':
-                    self._changed = True
+                # A property may have been changed! Remember which one.
+                if name in field_names:
+                    if '_dirty' not in self.__dict__:
+                        self.__dict__['_dirty'] = set()
+                    # Setting something to what it already was isn't a change, but
+                    # lists and dicts may have been changed in place, so assume they are
+                    if isinstance(value, (list, dict)) or name not in self.__dict__ or self.__dict__[name] != value:
+                        self._dirty.add(name)
                 super().__setattr__(name, value)
 
             def replace(self, **changes):
@@ -33,19 +47,60 @@ def component(networked: bool = False):
 
             def has_changed(self):
                 # Has the element been changed since we last checked?
-                return self._changed
+                return bool(self.__dict__.get('_dirty'))
+
+            def changed_fields(self):
+                # Which properties have changed since we last checked?
+                return set(self.__dict__.get('_dirty', ()))
 
             def observed_changes(self):
                 # Acknowledge that we've seen all new changes.
-                self._changed = False
+                self.__dict__['_dirty'] = set()
 
             def as_dict(self):
                 # Get the component as a JSON object.
                 return dataclasses.asdict(self)
 
+            def as_changes(self):
+                # Get only the properties that have changed as a JSON object.
+                sent = self.__dict__.setdefault('_sent', {})
+                dirty = self.changed_fields()
+                changes = {}
+                for name in field_names:
+                    value = getattr(self, name)
+                    if isinstance(value, (list, dict)):
+                        # We can't see changes made inside lists and dicts, so
+                        # compare them with what we last gave out instead
+                        plain = as_plain(value)
+                        if name not in sent or sent[name] != plain:
+                            changes[name] = plain
+                            sent[name] = plain
+                    elif name in dirty:
+                        changes[name] = as_plain(value)
+                return changes
+
             def is_networked(self):
                 # Should this component be sent across the network?
                 return networked
+        registry.append(Component)
         return Component
     return componentWrapper
 
+def get_registry_hash() -> str:
+    """Sums up every component's type_id, name and fields' types. If someone else's
+    is the same as ours, we mean the same things by the same type_ids."""
+    description = ';'.join(
+        '{}:{}:{}'.format(clas.type_id, clas.type_name, ','.join('{}={}'.format(field.name, field.type) for field in dataclasses.fields(clas)))
+        for clas in registry
+    )
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+def as_plain(value):
+    """Turn a property into dicts, lists and basic types, like dataclasses.asdict does."""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(as_plain(item) for item in value)
+    if isinstance(value, dict):
+        return {key: as_plain(item) for key, item in value.items()}
+    return value
@@ -1,7 +1,8 @@
-import pygame, sys, platform, os
+import pygame, sys, platform, os, time
 
 from lib.network import Network
 from lib.menu import MenuState
+from lib.profiler import Profiler
 
 class Framework:
     """The core state of our app."""
@@ -11,16 +12,36 @@ class Framework:
     dimensions = (1024, 824)
 
     fps = 60
+    # How many times a second we send our changes to everyone else
+    tick_rate = 20
     running = True
     clock = pygame.time.Clock()
 
-    def __init__(self, GameState):
+    def __init__(self, GameState, dirty_rects=False, headless=False, systems=None, profile_path=None):
+        # Only send the parts of the screen that have changed to the display
+        self.dirty_rects = dirty_rects
+        # Host without a window, sound or a player of our own
+        self.headless = headless
+        # Names of the systems the game should run, or None for the usual ones
+        self.systems = systems
+        # Times each part of every frame, saved to profile_path when we quit
+        self.profiler = Profiler()
+        self.profile_path = profile_path
+
+        if headless:
+            # Nothing to draw to or play sound on, but pygame still wants them
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
         # Initialise pygame
         pygame.init()
         pygame.font.init()
         pygame.mixer.init()
         pygame.display.set_caption(self.caption)
-        self.screen = pygame.display.set_mode(self.dimensions, pygame.HWSURFACE | pygame.DOUBLEBUF | pygame.RESIZABLE)
+        if headless:
+            self.screen = pygame.display.set_mode(self.dimensions)
+        else:
+            self.screen = pygame.display.set_mode(self.dimensions, pygame.HWSURFACE | pygame.DOUBLEBUF | pygame.RESIZABLE)
 
         # Delegate
         self.net = Network()
@@ -30,10 +51,13 @@ class Framework:
     def main_loop(self):
         # Initial tick so our first tick doesn't return all the time since __init__
         self.clock.tick()
-        
+        # Time since we last sent our changes
+        tick_time = 0.0
+
 
         # While we haven't been stopped
         while self.running:
+            resized = False
             # Black-out the screen
             self.screen.fill((0, 0, 0))
 
@@ -52,14 +76,68 @@ class Framework:
                     SCREENSIZE = (event.w,event.h)
                     pygame.display.set_mode(SCREENSIZE, pygame.HWSURFACE | pygame.DOUBLEBUF | pygame.RESIZABLE)
                     self.dimensions = SCREENSIZE
+                    resized = True
 
             # Update the current state
+            frame_start = time.perf_counter()
             self.state.update(dt, events)
 
+            # Send our changes at a fixed rate, no matter how fast we're drawing
+            tick_time += dt
+            if tick_time >= 1.0 / self.tick_rate:
+                tick_time %= 1.0 / self.tick_rate
+                self.state.tick()
+
             # Display any rendered updates
-            pygame.display.update()
+            rects = self.state.get_dirty_rects() if self.dirty_rects and not resized else None
+            with self.profiler.measure('display.update'):
+                if rects is None:
+                    pygame.display.update()
+                else:
+                    pygame.display.update(rects)
+            self.profiler.record('frame', (time.perf_counter() - frame_start) * 1000)
+
+        self.quit()
+
+    def host_loop(self, group):
+        """Host a game of the given name without a window. We simulate at a
+        fixed rate and send our changes at our tick rate, like main_loop."""
+        self.net.host_group(group)
+        self.state = self.GameState(self, 'Host', None, None)
+
+        # Every update is the same length, however late we are
+        dt = 1.0 / self.fps
+        tick_time = 0.0
+        self.clock.tick()
+
+        try:
+            while self.running:
+                # Sleep until it's time for the next update
+                self.clock.tick(self.fps)
+
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        self.running = False
+
+                frame_start = time.perf_counter()
+                self.state.update(dt, [])
+
+                tick_time += dt
+                if tick_time >= 1.0 / self.tick_rate:
+                    tick_time %= 1.0 / self.tick_rate
+                    self.state.tick()
+                self.profiler.record('frame', (time.perf_counter() - frame_start) * 1000)
+        except KeyboardInterrupt:
+            pass
+
+        self.quit()
+
+    def quit(self):
+        # We've stopped, save how long everything took
+        if self.profile_path is not None:
+            self.profiler.dump(self.profile_path)
 
-        # We've stopped, quit the network, close pygame, kill everything
+        # Quit the network, close pygame, kill everything
         self.net.node.leave(self.net.get_our_group() or '')
         pygame.display.quit()
         self.net.close()
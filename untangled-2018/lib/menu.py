@@ -5,6 +5,7 @@ from string import printable
 from enum import Enum
 
 from lib.config import HOSTNAME
+from lib.text import text_cache
 
 
 class MenuStates(Enum):
@@ -75,6 +76,14 @@ class MenuState:
             self.get_current().render()
             self.get_current().update(dt, events)
 
+    def tick(self):
+        # Nothing to send until we're in a game
+        pass
+
+    def get_dirty_rects(self):
+        # Menus are redrawn from scratch each frame
+        return None
+
 class MenuItem:
     def __init__(self, menu_state: MenuState, options={}):
         self.menu_state = menu_state
@@ -146,7 +155,7 @@ class MenuItem:
 
 
     def render_text(self, font, text, pos=(0, 0), colour=(255, 255, 255)):
-        rendered_text_surface = font.render(text, False, colour)
+        rendered_text_surface = text_cache.render(font, text, colour)
         self.screen.blit(rendered_text_surface, pos)
 
     def render_options(self, font, offset=(0, 0)):
@@ -1,17 +1,59 @@
 import bson
+import struct
 import sys
+import time
 import uuid
 import zmq
 from pyre import Pyre
 from typing import List, Union
 
 import game.components as components
+from lib.component import registry, get_registry_hash
+from lib.codec import PackedWriter, read_packed
 
+# Never spend longer than this sliding an entity to where it was last seen
+MAX_INTERPOLATION = 0.25
+# How far past the edge of their screen players hear about things
+INTEREST_MARGIN = 128
+# How much further again something they already know about has to go before they forget it
+INTEREST_HYSTERESIS = 256
+# How often, in snapshots, the host tells each peer every entity they should know about
+RECONCILE_EVERY = 100
 
 class Network:
     hosting: bool = False
 
     def __init__(self):
+        # Our snapshots are numbered, so others can tell if they've missed one
+        self.seq = 0
+        # The last snapshot number we've used from each peer
+        self.baselines = {}
+        # Peers we've asked to tell us everything
+        self.resyncing = set()
+        # When we last got a snapshot from each peer
+        self.received_at = {}
+        # Entity keys -> the small numbers we call them by when talking to others
+        self.handles = {}
+        self.next_handle = 0
+        # What each peer calls each entity, peer -> {handle: key}
+        self.peer_keys = {}
+        # Packs the components we can into our snapshots
+        self.writer = PackedWriter()
+        # The peer hosting our group, once we've heard from them
+        self.host = None
+        # Maps the host has sent us, by their hash, until MapSystem picks them up
+        self.received_maps = {}
+        # When hosting, the entities each peer knows about, and how many snapshots we've sent them
+        self.peer_known = {}
+        self.peer_seq = {}
+        # When hosting, how big each peer's screen is
+        self.peer_views = {}
+        # When not hosting, the entities we've made, the ones we've told the
+        # host our handle for, and the screen size we last told them
+        self.made = set()
+        self.named = set()
+        self.sent_view = None
+
         self.open()
 
     def get_all_groups(self) -> List[str]:
@@ -47,6 +89,10 @@ class Network:
         if self.is_in_group():
             raise ValueError('You must leave the previous group before you join another')
 
+        for peer in self.node.peers():
+            if self.node.peer_header_value(peer, 'hosting') == group and not self.is_compatible(peer):
+                raise ValueError('The host of "{}" is on a different version of the game'.format(group))
+
         self.node.join(group)
 
     def leave_group(self) -> None:
@@ -74,6 +120,8 @@ class Network:
     def open(self) -> None:
         """Create a new pyre instance and join untangled."""
         self.node = Pyre()
+        # So others can check we mean the same components by the same type_ids
+        self.node.set_header('components', get_registry_hash())
         self.node.start()
         self.node.join('untangled2018')
         # used to get our messages
@@ -84,6 +132,10 @@ class Network:
         """Get our id, as a unique node on the network."""
         return self.node.uuid()
 
+    def is_compatible(self, peer) -> bool:
+        """Does a peer have the same components as us?"""
+        return self.node.peer_header_value(peer, 'components') == get_registry_hash()
+
     def is_me(self, player_id) -> bool:
         """See if a given id is ours."""
         return self.get_id() == player_id
@@ -108,64 +160,481 @@ class Network:
     def pull_game(self, game):
         """Update our game state based on what other people tell us."""
         for msg in self.get_messages():
+            if msg.type == 'WHISPER':
+                # Someone is talking to just us
+                message = bson.loads(msg.msg[0])
+                if message.get('resync'):
+                    # They've lost track of our changes, tell them everything
+                    self.whisper_game(game, msg.peer_uuid)
+                elif 'map_request' in message:
+                    self.whisper_map(game, msg.peer_uuid, message['map_request'])
+                elif 'map' in message:
+                    self.received_maps[message['map']['hash']] = message['map']
+                else:
+                    self.apply_snapshot(game, msg.peer_uuid, message)
+                continue
             # is it relevant to us?
             if msg.group != self.get_our_group():
                 continue
             if msg.type == 'SHOUT':
-                entities = bson.loads(msg.msg[0])
-
-                if 'ids' in entities:
-                    keys = entities['ids']
-                    cur_keys = list(game.entities.keys())
-                    diff = list(set(cur_keys) - set(keys))
-                    for key in diff:
-                        del game.entities[key]
-
-                entities = entities['components']
-                for key, changed_comps in entities.items():
-                    key = uuid.UUID(key)
-                    if key not in game.entities:
-                        game.entities[key] = {}
-                    entity = game.entities[key]
-                    for compname, component in changed_comps.items():
-                        try:
-                            clas = components.__dict__[compname]
-                            if clas in entity:
-                                entity[clas] = entity[clas].replace(**component)
-                            else:
-                                entity[clas] = clas(**component)
-                            entity[clas].observed_changes()
-                        except Exception:
-                            print('Error updating component, is everyone in the group on the same version?', file=sys.stdout)
+                self.apply_snapshot(game, msg.peer_uuid, bson.loads(msg.msg[0]))
             elif self.is_hosting():
                 if msg.type == 'JOIN':
+                    if not self.is_compatible(msg.peer_uuid):
+                        print('A player tried to join on a different version of the game', file=sys.stdout)
+                        continue
                     game.on_player_join(msg.peer_uuid)
-                    self.push_game(game, initial=True)
+                    self.whisper_game(game, msg.peer_uuid)
                 elif msg.type == 'EXIT' or msg.type == "LEAVE":
                     game.on_player_quit(msg.peer_uuid)
 
-    def push_game(self, game, initial=False):
-        """Tell others how we've changed the game state."""
-        if len(self.node.peers_by_group(self.get_our_group())) == 0:
-            # Nobody else to talk to
+    def apply_snapshot(self, game, peer, snapshot):
+        """Update our game state from a snapshot someone has sent us.
+
+        Snapshots other than full ones only hold what has changed since the
+        sender's previous snapshot, so we can only use them if we've seen that.
+
+        Entities are called by the sender's handles for them, which they tell
+        us about when they first mention an entity, and components by type_id.
+        Components come packed, or as BSON in 'components' if they couldn't be.
+
+        Everyone but the host only talks to the host. The host makes the
+        entities they've made, and passes what they've changed on to whoever
+        else is near it. Entities are only made when they're in 'created', so
+        changes to something we've since deleted don't bring it back."""
+        if 'view' in snapshot:
+            self.peer_views[peer] = tuple(snapshot['view'])
+        if not snapshot['host'] and not self.is_hosting():
+            # Only the host tells us about the game
+            return
+        seq = snapshot['seq']
+        now = time.time()
+        # Spread their movement over the time between their snapshots
+        duration = min(now - self.received_at.get(peer, now), MAX_INTERPOLATION)
+        self.received_at[peer] = now
+        if snapshot['host']:
+            self.host = peer
+
+        # Unpack everything first, so a snapshot we can't read changes nothing
+        try:
+            found = list(self.read_components(snapshot))
+        except (IndexError, KeyError, ValueError, struct.error):
+            print('Error reading snapshot, is everyone in the group on the same version?', file=sys.stdout)
+            self.request_resync(peer)
+            return
+
+        if snapshot['full']:
+            self.resyncing.discard(peer)
+            if snapshot['host']:
+                # The host knows which entities exist, forget any it doesn't
+                keys = set(snapshot['created'].values())
+                for key in list(game.entities.keys()):
+                    if str(key) not in keys:
+                        del game.entities[key]
+            # They've told us what they call everything, so start again
+            self.peer_keys[peer] = {}
+        elif peer in self.resyncing:
+            # Wait for them to send us everything
+            return
+        elif peer in self.baselines and seq != self.baselines[peer] + 1:
+            # We've missed some of their changes
+            self.request_resync(peer)
             return
+        self.baselines[peer] = seq
+
+        peer_keys = self.peer_keys.setdefault(peer, {})
+        created = set()
+        for handle, key in snapshot['created'].items():
+            key = uuid.UUID(key)
+            peer_keys[int(handle)] = key
+            created.add(key)
+        # Entities we should already have, that they've just started calling something
+        for handle, key in snapshot.get('named', {}).items():
+            peer_keys[int(handle)] = uuid.UUID(key)
+
+        for handle in snapshot['destroyed']:
+            key = peer_keys.pop(handle, None)
+            if key in game.entities:
+                del game.entities[key]
+
+        # Still there, just too far away for us to hear about
+        for handle in snapshot.get('left', ()):
+            key = peer_keys.pop(handle, None)
+            if key in game.entities:
+                del game.entities[key]
+
+        # Build up new entities before adding them, so they're only stored once
+        new_entities = {}
+        for handle, type_id, fields in found:
+            key = peer_keys.get(handle)
+            if key is None:
+                # They've never told us which entity this is
+                self.request_resync(peer)
+                continue
+            if key in game.entities:
+                entity = game.entities[key]
+            elif key in created:
+                entity = new_entities.setdefault(key, {})
+            else:
+                # We've deleted it since they changed it. If it's still there,
+                # we'll find out when they next say what's alive
+                continue
+            try:
+                clas = registry[type_id]
+                if clas is components.IngameObject and 'position' in fields and clas in entity and not snapshot['full']:
+                    self.interpolate(entity, fields['position'], now, duration)
+                previous = entity.get(clas)
+                if previous is not None:
+                    entity[clas] = previous.replace(**fields)
+                else:
+                    entity[clas] = clas(**fields)
+                entity[clas].observed_changes()
+                if self.is_hosting():
+                    self.relay(entity[clas], previous, peer, fields)
+            except TypeError:
+                if snapshot['full']:
+                    print('Error updating component, is everyone in the group on the same version?', file=sys.stdout)
+                else:
+                    # We've been given part of a component we've never seen
+                    self.request_resync(peer)
+            except Exception:
+                print('Error updating component, is everyone in the group on the same version?', file=sys.stdout)
+        for key, entity in new_entities.items():
+            game.entities[key] = entity
+
+        for key in created:
+            if key not in game.entities:
+                game.entities[key] = {}
+
+        if 'alive' in snapshot:
+            # Everything they say we should know about, in case we've missed a deletion
+            alive = set(snapshot['alive'])
+            for handle in [handle for handle in peer_keys if handle not in alive]:
+                key = peer_keys.pop(handle)
+                if key in game.entities:
+                    del game.entities[key]
+            if any(peer_keys.get(handle) not in game.entities for handle in alive):
+                # Or something they've got that we haven't
+                self.request_resync(peer)
+
+        # They made these, not us, so they're not ours to tell anyone about
+        game.entities.added.difference_update(new_entities)
+        game.entities.added.difference_update(created)
+
+    def relay(self, component, previous, peer, fields):
+        """When hosting, mark what a peer has changed about a component so
+        snapshot_interests passes it on, though not back to them."""
+        dirty = set(fields)
+        origin = (peer, frozenset(fields))
+        if previous is not None and previous.has_changed():
+            # There are other changes to it that they haven't heard about yet
+            dirty |= previous.changed_fields()
+            origin = None
+        component.__dict__['_dirty'] = dirty
+        component.__dict__['_from'] = origin
+
+    def read_components(self, snapshot):
+        """Every (handle, type_id, fields) in a snapshot, packed or not."""
+        if snapshot.get('packed'):
+            yield from read_packed(snapshot['packed'])
+        for handle, changed_comps in snapshot['components'].items():
+            for type_id, fields in changed_comps.items():
+                yield int(handle), int(type_id), fields
+
+    def interpolate(self, entity, position, now, duration):
+        """Draw an entity sliding to its new position, rather than jumping there."""
+        Interpolated = components.Interpolated
+        io = entity[components.IngameObject]
+        if Interpolated in entity and entity[Interpolated].target == io.position:
+            # Carry on from wherever it's currently drawn
+            previous = entity[Interpolated].get_position(now)
+        else:
+            previous = io.position
+        entity[Interpolated] = Interpolated(previous=previous, target=position, received=now, duration=duration)
+
+    def request_resync(self, peer):
+        """Ask someone to tell us everything, as we've lost track of their changes."""
+        if peer not in self.resyncing:
+            self.resyncing.add(peer)
+            self.node.whisper(peer, bson.dumps({'resync': True}))
+
+    def request_map(self, hash):
+        """Ask the host to send us a map we don't have."""
+        if self.host is not None:
+            self.node.whisper(self.host, bson.dumps({'map_request': hash}))
 
-        entities = {
-            'components': {}
+    def whisper_map(self, game, peer, hash):
+        """Send someone a map they've asked for, compressed."""
+        for key, entity in game.query(components.Map, components.MapAsset):
+            if entity[components.MapAsset].hash == hash:
+                map = entity[components.Map]
+                self.node.whisper(peer, bson.dumps({'map': {
+                    'hash': hash,
+                    'width': map.width,
+                    'height': map.height,
+                    'tiles': map.pack()
+                }}))
+                return
+
+    def snapshot_game(self, game, full=False, only=None):
+        """Describe the game state. Unless full, this is only what has changed
+        since our last snapshot: changed properties of components, and which
+        entities have been created or destroyed, as the World recorded them.
+        Full snapshots can be of only some entities, e.g. those someone can see.
+
+        Entities are called by our handles for them, and created says which
+        entity each new handle is. Components are called by their type_id,
+        and packed together into 'packed' unless they can't be.
+
+        When we're not hosting, created is only the entities we've made, and
+        named says what we call the ones the host made, so it doesn't make
+        them again. We also say how big our screen is, when it changes."""
+        hosting = self.is_hosting()
+        snapshot = {
+            'seq': self.seq,
+            'full': full,
+            'host': hosting,
+            'created': {},
+            'destroyed': [],
+            'components': {},
+            'packed': b''
+        }
+        if not hosting:
+            snapshot['named'] = {}
+        writer = self.writer
+        writer.clear()
+        if full:
+            # Full snapshots don't count as a change, so they don't move us on
+            keys = set(game.entities.keys())
+            if only is not None:
+                keys &= only
+            made = keys if hosting else keys & self.made
+            snapshot['created'] = {str(self.get_handle(key)): str(key) for key in made}
+            if not hosting:
+                snapshot['named'] = {str(self.get_handle(key)): str(key) for key in keys - made}
+                self.named = set(keys)
+        else:
+            self.seq += 1
+            snapshot['seq'] = self.seq
+            added, deleted = game.entities.take_changes()
+            snapshot['created'] = {str(self.get_handle(key)): str(key) for key in added}
+            # Anything we never gave a handle to, nobody knew about
+            gone = [key for key in deleted if key in self.handles]
+            if hosting:
+                # Only the host gets to say what no longer exists
+                snapshot['destroyed'] = [self.handles[key] for key in gone]
+            else:
+                self.made |= added
+                self.made -= deleted
+                self.named |= added
+                self.named -= deleted
+            for key in gone:
+                del self.handles[key]
+
+        if not hosting and (full or game.framework.dimensions != self.sent_view):
+            self.sent_view = game.framework.dimensions
+            snapshot['view'] = list(self.sent_view)
+
+        for key, entity in game.entities.items():
+            if full and key not in keys:
+                continue
+            start = writer.offset
+            changed_comps = self.describe_entity(key, entity, full)
+            if changed_comps:
+                snapshot['components'][str(self.get_handle(key))] = changed_comps
+            if not hosting and key not in self.named and (changed_comps or writer.offset > start):
+                # The host hasn't heard what we call it yet
+                self.named.add(key)
+                snapshot['named'][str(self.handles[key])] = str(key)
+        snapshot['packed'] = writer.getvalue()
+        return snapshot
+
+    def describe_entity(self, key, entity, full):
+        """Pack everything about an entity, or only what's changed, into our
+        writer. Returns what couldn't be packed, by type_id."""
+        changed_comps = {}
+        for component in entity.values():
+            if not component.is_networked():
+                continue
+            changes = self.describe_component(key, component, full)
+            if changes:
+                changed_comps[str(component.type_id)] = changes
+        return changed_comps
+
+    def describe_component(self, key, component, full):
+        """Pack a component, or only what's changed about it, into our writer.
+        Returns it as a dict if it couldn't be packed."""
+        if full:
+            if not self.writer.add(self.get_handle(key), component):
+                return component.as_dict()
+        elif component.has_changed():
+            changes = component.as_changes()
+            component.observed_changes()
+            if changes and not self.writer.add(self.get_handle(key), component, changes):
+                return changes
+        return None
+
+    def get_handle(self, key) -> int:
+        """The small number we call an entity by when talking to others."""
+        handle = self.handles.get(key)
+        if handle is None:
+            handle = self.handles[key] = self.next_handle
+            self.next_handle += 1
+        return handle
+
+    def get_interest(self, game, peer, players, positions, known=frozenset()):
+        """The keys of every entity a peer should hear about: those near their
+        player and those without a position. Ones they already know about
+        stay until they're a bit further away, so nothing flickers in and out
+        at the edge. Anything being held, like a sword, comes with whoever
+        holds it. Everything, if they don't have a player.
+
+        How near is by the size of their screen, or ours if they haven't said."""
+        player = players.get(str(peer))
+        if player is None:
+            return set(game.entities.keys())
+        width, height = self.peer_views.get(peer, game.framework.dimensions)
+        near = (width / 2 + INTEREST_MARGIN, height / 2 + INTEREST_MARGIN)
+        far = (near[0] + INTEREST_HYSTERESIS, near[1] + INTEREST_HYSTERESIS)
+        interest = set()
+        for key in game.entities.keys():
+            position = positions.get(key)
+            if position is None:
+                interest.add(key)
+                continue
+            x = abs(position[0] - player[0])
+            y = abs(position[1] - player[1])
+            if (x <= near[0] and y <= near[1]) or (key in known and x <= far[0] and y <= far[1]):
+                interest.add(key)
+
+        # Things someone is holding come and go with them, wherever they are
+        for key, entity in game.query(components.Wieldable):
+            owner = entity[components.Wieldable].player_id
+            if owner is None or owner not in game.entities:
+                continue
+            if owner in interest:
+                interest.add(key)
+            else:
+                interest.discard(key)
+        return interest
+
+    def get_places(self, game):
+        """Where each player is, by their player_id, and where everything else is, by key."""
+        players = {
+            str(entity[components.PlayerControl].player_id): entity[components.IngameObject].position
+            for key, entity in game.query(components.PlayerControl, components.IngameObject)
         }
+        positions = {key: entity[components.IngameObject].position for key, entity in game.query(components.IngameObject)}
+        return players, positions
+
+    def whisper_game(self, game, peer):
+        """Tell someone everything about the game state, e.g. when they've just
+        joined. When hosting, that's only what's near them."""
         if self.is_hosting():
-            entities = {
-                'ids': [],
-                'components': {}
-            }
+            players, positions = self.get_places(game)
+            interest = self.get_interest(game, peer, players, positions)
+            self.peer_known[peer] = interest
+            snapshot = self.snapshot_game(game, full=True, only=interest)
+            snapshot['seq'] = self.peer_seq.get(peer, 0)
+        else:
+            snapshot = self.snapshot_game(game, full=True)
+        self.node.whisper(peer, bson.dumps(snapshot))
+
+    def push_game(self, game):
+        """Tell others how we've changed the game state."""
+        peers = self.node.peers_by_group(self.get_our_group())
+        if len(peers) == 0:
+            # Nobody else to talk to, so nobody to tell what's come and gone
+            game.entities.take_changes()
+            return
+
+        if self.is_hosting():
+            for peer, snapshot in self.snapshot_interests(game, peers).items():
+                self.node.whisper(peer, bson.dumps(snapshot))
+        elif self.host is not None:
+            # The host passes it on to whoever it concerns
+            self.node.whisper(self.host, bson.dumps(self.snapshot_game(game)))
+
+    def snapshot_interests(self, game, peers):
+        """What's changed, for each peer, about only the entities near them.
 
+        Everything that's changed is described once and shared out, except
+        back to whoever changed it, if it came from them. Entities
+        coming near someone are described in full, and they're told which
+        have gone out of their way in 'left', so they can forget them. Every
+        RECONCILE_EVERY snapshots they're also told all they should know
+        about in 'alive', in case anything has gone wrong."""
+        added, gone = game.entities.take_changes()
+        writer = self.writer
+        writer.clear()
+
+        # What's changed about everything, once for everyone:
+        # key -> [(start, end, type_id, unpacked, who it came from)]
+        changed = {}
         for key, entity in game.entities.items():
-            changed_comps = {}
             for component in entity.values():
-                if component.is_networked() and (initial or component.has_changed()):
-                    changed_comps[component.get_name()] = component.as_dict()
-                    component.observed_changes()
-            if 'ids' in entities:
-                entities['ids'].append(key)
-            entities['components'][str(key)] = changed_comps
-        self.node.shout(self.get_our_group(), bson.dumps(entities))
+                if not component.is_networked() or not component.has_changed():
+                    continue
+                origin = component.__dict__.pop('_from', None)
+                if origin is not None and not component.changed_fields() <= origin[1]:
+                    # We've changed it since, so they need to hear about it too
+                    origin = None
+                start = writer.offset
+                changes = self.describe_component(key, component, False)
+                if writer.offset > start or changes:
+                    changed.setdefault(key, []).append(
+                        (start, writer.offset, component.type_id, changes, origin and origin[0]))
+        # Everything about entities someone has just come near, once for everyone
+        described = {}
+
+        players, positions = self.get_places(game)
+        snapshots = {}
+        for peer in peers:
+            known = self.peer_known.get(peer, set())
+            interest = self.get_interest(game, peer, players, positions, known)
+            self.peer_known[peer] = interest
+            self.peer_seq[peer] = self.peer_seq.get(peer, 0) + 1
+
+            packed = []
+            unpacked = {}
+            for key, pieces in changed.items():
+                if key in known and key in interest:
+                    for start, end, type_id, changes, origin in pieces:
+                        if origin == peer:
+                            continue
+                        packed.append(writer.buffer[start:end])
+                        if changes:
+                            unpacked.setdefault(str(self.handles[key]), {})[str(type_id)] = changes
+            entering = interest - known
+            for key in entering:
+                if key not in described:
+                    start = writer.offset
+                    changed_comps = self.describe_entity(key, game.entities[key], True)
+                    described[key] = (start, writer.offset, changed_comps)
+                start, end, changed_comps = described[key]
+                packed.append(writer.buffer[start:end])
+                if changed_comps:
+                    unpacked[str(self.handles[key])] = changed_comps
+
+            snapshots[peer] = {
+                'seq': self.peer_seq[peer],
+                'full': False,
+                'host': True,
+                'created': {str(self.get_handle(key)): str(key) for key in entering},
+                'destroyed': [self.handles[key] for key in known & gone],
+                'left': [self.handles[key] for key in (known - interest) - gone],
+                'components': unpacked,
+                'packed': b''.join(packed)
+            }
+            if self.peer_seq[peer] % RECONCILE_EVERY == 0:
+                snapshots[peer]['alive'] = [self.get_handle(key) for key in interest]
+
+        for key in gone:
+            self.handles.pop(key, None)
+        for peer in list(self.peer_known.keys()):
+            if peer not in peers:
+                # They've gone
+                del self.peer_known[peer]
+                self.peer_seq.pop(peer, None)
+                self.peer_views.pop(peer, None)
+        return snapshots
@@ -0,0 +1,75 @@
+import csv
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# How many of the most recent timings of each thing we keep
+WINDOW = 600
+
+
+class Profiler:
+    """Times how long each part of a frame takes, and keeps count of how
+    much of everything there is.
+
+    Timings are in milliseconds, and only the last WINDOW of each are kept,
+    so the percentiles follow what's happening now."""
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        # name -> recent timings
+        self.timings = {}
+        # name -> how many times it's been timed, ever
+        self.calls = {}
+        # name -> the latest count of something, e.g. entities
+        self.counts = {}
+
+    @contextmanager
+    def measure(self, name: str):
+        """Time everything done inside a `with profiler.measure(name):`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name: str, ms: float):
+        if name not in self.timings:
+            self.timings[name] = deque(maxlen=self.window)
+            self.calls[name] = 0
+        self.timings[name].append(ms)
+        self.calls[name] += 1
+
+    def count(self, name: str, value: int):
+        self.counts[name] = value
+
+    def get_stats(self) -> dict:
+        """The mean and p50/p95/p99 of each thing we've timed recently."""
+        stats = {}
+        for name, timings in self.timings.items():
+            p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+            stats[name] = {
+                'calls': self.calls[name],
+                'mean': float(np.mean(timings)),
+                'p50': float(p50),
+                'p95': float(p95),
+                'p99': float(p99),
+            }
+        return stats
+
+    def dump(self, path: str):
+        """Save our stats to a file, as CSV if it ends in .csv or JSON otherwise."""
+        stats = self.get_stats()
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['name', 'calls', 'mean', 'p50', 'p95', 'p99'])
+                for name, row in stats.items():
+                    writer.writerow([name, row['calls'], row['mean'], row['p50'], row['p95'], row['p99']])
+                for name, value in self.counts.items():
+                    writer.writerow([name, value, '', '', '', ''])
+        else:
+            with open(path, 'w') as f:
+                json.dump({'timings': stats, 'counts': self.counts}, f, indent=2)
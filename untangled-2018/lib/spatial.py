@@ -0,0 +1,41 @@
+import math
+
+
+class PointGrid:
+    """Buckets points into a grid of cells, so finding the nearest point
+    within some radius only needs to look at the cells around it.
+
+    Made for things that are built again each frame, like where the players are."""
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        # (cell x, cell y) -> [(key, position)] of the points in that cell
+        self.cells = {}
+
+    def get_cell(self, position):
+        return (math.floor(position[0] / self.cell_size), math.floor(position[1] / self.cell_size))
+
+    def add(self, key, position):
+        self.cells.setdefault(self.get_cell(position), []).append((key, position))
+
+    def clear(self):
+        self.cells.clear()
+
+    def __len__(self):
+        return sum(len(points) for points in self.cells.values())
+
+    def nearest(self, position, radius: float):
+        """The (key, position, distance) of the nearest point no further than
+        radius away, or None if there isn't one."""
+        reach = math.ceil(radius / self.cell_size)
+        cell_x, cell_y = self.get_cell(position)
+        best = None
+        best_distance = radius
+        for x in range(cell_x - reach, cell_x + reach + 1):
+            for y in range(cell_y - reach, cell_y + reach + 1):
+                for key, point in self.cells.get((x, y), ()):
+                    distance = math.hypot(point[0] - position[0], point[1] - position[1])
+                    if distance <= best_distance:
+                        best = (key, point, distance)
+                        best_distance = distance
+        return best
@@ -0,0 +1,40 @@
+from collections import OrderedDict
+
+# How many pieces of rendered text to keep at once
+MAX_TEXT_SURFACES = 256
+
+
+class TextCache:
+    """Remembers text we've rendered, as rendering with a font is slow and
+    most of what we draw is the same from one frame to the next.
+
+    The surfaces handed out are shared, so don't draw on them."""
+
+    def __init__(self, size: int = MAX_TEXT_SURFACES):
+        self.size = size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, colour):
+        """Like font.render(text, False, colour), but only renders it once."""
+        text_key = (font, text, tuple(colour))
+        if text_key in self.surfaces:
+            self.hits += 1
+            self.surfaces.move_to_end(text_key)
+            return self.surfaces[text_key]
+
+        self.misses += 1
+        surface = font.render(text, False, colour)
+        self.surfaces[text_key] = surface
+        if len(self.surfaces) > self.size:
+            # Forget whichever we've gone longest without drawing
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+
+
+# Shared by everything that draws text
+text_cache = TextCache()
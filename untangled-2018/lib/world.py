@@ -0,0 +1,218 @@
+from collections.abc import MutableMapping
+from typing import FrozenSet, Iterator, Tuple
+
+
+class Entity(dict):
+    """A bundle of components, keyed by their class.
+
+    Acts exactly like a dict, but tells the World it lives in whenever a
+    component is added or removed, so it can be moved to the right archetype."""
+
+    def __init__(self, world, key, components=()):
+        super().__init__(components)
+        self._world = world
+        self._key = key
+
+    def __setitem__(self, clas, component):
+        is_new = clas not in self
+        super().__setitem__(clas, component)
+        if is_new and self._world is not None:
+            self._world._restructure(self._key)
+
+    def __delitem__(self, clas):
+        super().__delitem__(clas)
+        if self._world is not None:
+            self._world._restructure(self._key)
+
+    def pop(self, clas, *default):
+        had = clas in self
+        value = super().pop(clas, *default)
+        if had and self._world is not None:
+            self._world._restructure(self._key)
+        return value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        if self._world is not None:
+            self._world._restructure(self._key)
+
+    def setdefault(self, clas, default=None):
+        if clas in self:
+            return self[clas]
+        self[clas] = default
+        return default
+
+    def popitem(self):
+        item = super().popitem()
+        if self._world is not None:
+            self._world._restructure(self._key)
+        return item
+
+    def clear(self):
+        super().clear()
+        if self._world is not None:
+            self._world._restructure(self._key)
+
+
+class Archetype:
+    """A table of every entity that has exactly the same set of components.
+
+    Only changes when entities come, go or gain and lose components, as
+    queries hand out the entities themselves. Replacing one of an entity's
+    components doesn't touch it."""
+
+    def __init__(self, signature: FrozenSet[type]):
+        self.signature = signature
+        # key -> Entity
+        self.entities = {}
+        # Every query this table's entities belong to
+        self.queries = []
+
+    def __len__(self):
+        return len(self.entities)
+
+    def add(self, key, entity):
+        self.entities[key] = entity
+        for query in self.queries:
+            query._entities[key] = entity
+
+    def remove(self, key):
+        for query in self.queries:
+            del query._entities[key]
+        del self.entities[key]
+
+
+class Query:
+    """Every entity that has a given set of components.
+
+    Kept up to date by the World as entities and components come and go, so
+    asking for it again is cheap."""
+
+    def __init__(self, signature: FrozenSet[type]):
+        self.signature = signature
+        self._entities = {}
+
+    def __iter__(self) -> Iterator[Tuple[object, Entity]]:
+        # Copy, so systems can add and delete entities while looping
+        return iter(list(self._entities.items()))
+
+    def __len__(self):
+        return len(self._entities)
+
+    def __contains__(self, key):
+        return key in self._entities
+
+    def keys(self):
+        return self._entities.keys()
+
+    def first(self) -> Tuple[object, Entity]:
+        """Get (key, entity) for any one matching entity, or (None, None)."""
+        for item in self._entities.items():
+            return item
+        return None, None
+
+
+class World(MutableMapping):
+    """Stores our entities in archetypes, so we can find every entity with a
+    given set of components without looking at every other entity.
+
+    Still looks like a dict of {key: {ComponentClass: component}}, so
+    `world[key][Component]`, `key in world` and `del world[key]` all work."""
+
+    def __init__(self):
+        self._entities = {}
+        self._archetypes = {}
+        self._location = {}
+        # Queries we keep up to date, by the components they ask for
+        self._queries = {}
+        # Called with the key of every entity we delete
+        self.on_delete = []
+        # Keys added and deleted since someone last took them, e.g. to tell others
+        self.added = set()
+        self.deleted = set()
+
+    def __getitem__(self, key) -> Entity:
+        return self._entities[key]
+
+    def __setitem__(self, key, components):
+        existed = key in self._entities
+        if existed:
+            # Replacing an entity isn't deleting it, so nobody gets told it's gone
+            self._location.pop(key).remove(key)
+            self._entities[key]._world = None
+        entity = Entity(self, key, components)
+        self._entities[key] = entity
+        self._place(key, entity)
+        self.deleted.discard(key)
+        if not existed:
+            self.added.add(key)
+
+    def __delitem__(self, key):
+        entity = self._entities.pop(key)
+        self._location.pop(key).remove(key)
+        # It may still be referenced elsewhere, but it's not ours anymore
+        entity._world = None
+        self.added.discard(key)
+        self.deleted.add(key)
+        for callback in self.on_delete:
+            callback(key)
+
+    def __contains__(self, key):
+        return key in self._entities
+
+    def __iter__(self):
+        return iter(self._entities)
+
+    def __len__(self):
+        return len(self._entities)
+
+    def keys(self):
+        return self._entities.keys()
+
+    def values(self):
+        return self._entities.values()
+
+    def items(self):
+        return self._entities.items()
+
+    def take_changes(self):
+        """The keys added and deleted since we were last asked, and forget them."""
+        added, deleted = self.added, self.deleted
+        self.added = set()
+        self.deleted = set()
+        return added, deleted
+
+    def query(self, *components) -> Query:
+        """Get every entity that has all of the given components.
+
+        The first time we're asked for a set of components we register a
+        Query for it, after that the same Query is handed back."""
+        signature = frozenset(components)
+        if signature not in self._queries:
+            query = Query(signature)
+            for archetype in self._archetypes.values():
+                if signature <= archetype.signature:
+                    archetype.queries.append(query)
+                    query._entities.update(archetype.entities)
+            self._queries[signature] = query
+        return self._queries[signature]
+
+    def _get_archetype(self, signature: FrozenSet[type]) -> Archetype:
+        if signature not in self._archetypes:
+            archetype = Archetype(signature)
+            self._archetypes[signature] = archetype
+            # Let any queries we've already seen know about it
+            for queried, query in self._queries.items():
+                if queried <= signature:
+                    archetype.queries.append(query)
+        return self._archetypes[signature]
+
+    def _place(self, key, entity: Entity):
+        archetype = self._get_archetype(frozenset(entity.keys()))
+        archetype.add(key, entity)
+        self._location[key] = archetype
+
+    def _restructure(self, key):
+        # The entity's components have changed, move it to its new table
+        self._location.pop(key).remove(key)
+        self._place(key, self._entities[key])
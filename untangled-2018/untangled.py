@@ -1,3 +1,5 @@
+import argparse
+
 from game.game import GameState
 from lib.framework import Framework
 
@@ -6,6 +8,23 @@ Howdy! If you're looking for the game's important code, look in game/game.py :)
 """
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Untangled 2018')
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help='only update the parts of the window that change, when we can')
+    parser.add_argument('--headless', metavar='GROUP',
+                        help='host a game of this name without a window or a player of our own')
+    parser.add_argument('--systems',
+                        help='comma separated names of the systems to run, e.g. AI_system,CollisionSystem')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='save how long each part of a frame took to PATH when we quit, as .csv or .json')
+    args = parser.parse_args()
+
+    systems = args.systems.split(',') if args.systems else None
+
     # Make a Framework based on our Game and run it!
-    app = Framework(GameState)
-    app.main_loop()
+    app = Framework(GameState, dirty_rects=args.dirty_rects, headless=args.headless is not None, systems=systems,
+                    profile_path=args.profile)
+    if args.headless is not None:
+        app.host_loop(args.headless)
+    else:
+        app.main_loop()